@@ -1,13 +1,57 @@
 """ This program prints a greeting to the user and asks for what they
 want to do and does something according to the user's choice
 """
+import argparse
+import asyncio
+import bisect
+import contextlib
+import copy
+import csv
+import functools
+import glob
+import hashlib
+import heapq
+import io
+import itertools
+import json
+import math
+import mmap
+import os
+import random
+import statistics
+import struct
+import sys
+import tempfile
+import threading
+import time
+import tracemalloc
+from array import array
+from collections import OrderedDict
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
 from enum import Enum
 
+try:
+    import resource
+except ImportError:
+    resource = None
+try:
+    import sqlite3
+except ImportError:
+    sqlite3 = None
+
 conversions = {"USD": 1, "EUR": 0.9, "CAD": 1.4, "GBP": 0.8,
                "CHF": 0.95,
                "NZD": 1.66, "AUD": 1.62, "JPY": 107.92}
 home_currency = ""
+data_currency = "USD"
 filename = './AB_NYC_2019.csv'
+chunk_size = 16 * 1024 * 1024
+profiler = None
+snapshot_magic = b"ABNB"
+snapshot_version = 4
+aggregates_version = 4
+host_column = "host_id"
+price_index_rows_per_second = 1000000
 
 
 class Categories(Enum):
@@ -19,15 +63,1570 @@ class Categories(Enum):
 
 
 class Stats(Enum):
-    """An Enum class that has the attributes of min, max, and avg"""
+    """An Enum class that has the attributes of min, max, avg, median,
+    the 90th and 99th percentiles, and the numbers of distinct listings
+    and hosts"""
     MIN = 0
     AVG = 1
     MAX = 2
+    MEDIAN = 3
+    P90 = 4
+    P99 = 5
+    DISTINCT_LISTINGS = 6
+    DISTINCT_HOSTS = 7
+
+
+column_names = {Categories.LOCATION: "neighbourhood_group",
+                Categories.PROPERTY_TYPE: "room_type"}
+quantiles = {Stats.MEDIAN: 0.5, Stats.P90: 0.9, Stats.P99: 0.99}
+distinct_counts = {Stats.DISTINCT_LISTINGS: 6, Stats.DISTINCT_HOSTS: 7}
+titles = {Stats.MIN: "Minimum", Stats.AVG: "Average", Stats.MAX: "Maximum",
+          Stats.MEDIAN: "Median", Stats.P90: "90th Pct",
+          Stats.P99: "99th Pct", Stats.DISTINCT_LISTINGS: "Listings",
+          Stats.DISTINCT_HOSTS: "Hosts"}
+
+
+class Profiler:
+    """Records the calls, wall time, rows scanned, and peak bytes
+    allocated of every instrumented operation, the peak being measured
+    from the memory in use when the operation started. Times, rows, and
+    bytes of an operation include those of the operations it calls on
+    the same thread. Allocations are traced for the whole process, so
+    the peak bytes of operations that run while other threads allocate
+    include those threads' memory
+    """
+
+    def __init__(self, trace_memory=True):
+        """Creates an empty profiler, tracing allocations with
+        tracemalloc if trace_memory is set"""
+        self.trace_memory = trace_memory
+        self.operations = {}
+        self._stacks = {}
+        self._recording = threading.Lock()
+        self._owns_tracing = False
+
+    def _active(self):
+        """Returns the frames of the operations running on the calling
+        thread, innermost last"""
+        return self._stacks.setdefault(threading.get_ident(), [])
+
+    def call(self, name, function, args, kwargs):
+        """Runs an instrumented function and records its cost"""
+        with self._recording:
+            record = self.operations.setdefault(
+                name, {"calls": 0, "seconds": 0.0, "rows": 0, "bytes": 0})
+        active = self._active()
+        tracing = self.trace_memory and tracemalloc.is_tracing()
+        frame = [record, 0, 0]
+        if tracing:
+            self._note_peak()
+            tracemalloc.reset_peak()
+            frame[1] = frame[2] = tracemalloc.get_traced_memory()[0]
+        active.append(frame)
+        start = time.perf_counter()
+        try:
+            return function(*args, **kwargs)
+        finally:
+            seconds = time.perf_counter() - start
+            if tracing:
+                self._note_peak()
+            active.pop()
+            with self._recording:
+                record["seconds"] += seconds
+                record["calls"] += 1
+                if tracing:
+                    record["bytes"] += frame[2] - frame[1]
+
+    def _note_peak(self):
+        """Raises the peak of every running operation, on any thread, to
+        the peak traced since the last reset, before the peak is reset
+        for another operation or read for one that has finished"""
+        peak = tracemalloc.get_traced_memory()[1]
+        for stack in list(self._stacks.values()):
+            for frame in list(stack):
+                frame[2] = max(frame[2], peak)
+
+    def add_rows(self, rows):
+        """Adds scanned rows to every operation running on the calling
+        thread"""
+        with self._recording:
+            for record in {id(record): record
+                           for record, _, _ in self._active()}.values():
+                record["rows"] += rows
+
+    def report(self):
+        """Returns a table of the recorded operations, slowest first"""
+        lines = [f"{'Operation':40}{'Calls':>8}{'Seconds':>12}"
+                 f"{'Rows':>12}{'Peak bytes':>14}"]
+        for name, record in sorted(self.operations.items(),
+                                   key=lambda item: -item[1]["seconds"]):
+            lines.append(f"{name:40}{record['calls']:>8}"
+                         f"{record['seconds']:>12.6f}{record['rows']:>12}"
+                         f"{record['bytes']:>14}")
+        return "\n".join(lines)
+
+    def to_json(self):
+        """Returns the recorded operations as a JSON string"""
+        return json.dumps(self.operations, indent=2)
+
+
+def enable_profiling(trace_memory=True):
+    """Starts recording instrumented operations and returns the
+    profiler that records them"""
+    global profiler
+    disable_profiling()
+    profiler = Profiler(trace_memory)
+    if trace_memory and not tracemalloc.is_tracing():
+        tracemalloc.start()
+        profiler._owns_tracing = True
+    return profiler
+
+
+def disable_profiling():
+    """Stops recording instrumented operations, and stops tracing
+    allocations if enable_profiling started it"""
+    global profiler
+    if profiler is not None and profiler._owns_tracing:
+        tracemalloc.stop()
+    profiler = None
+
+
+def instrumented(function):
+    """Records calls of a function while profiling is enabled. When it
+    is not, the only cost is one check of the profiler"""
+    name = function.__qualname__
+
+    @functools.wraps(function)
+    def wrapper(*args, **kwargs):
+        if profiler is None:
+            return function(*args, **kwargs)
+        return profiler.call(name, function, args, kwargs)
+    return wrapper
+
+
+def _count_rows(rows):
+    """Adds scanned rows to the running operations when profiling"""
+    if profiler is not None:
+        profiler.add_rows(rows)
+
+
+def read_header(path):
+    """Returns the column names in the first line of a UTF-8 csv file"""
+    with open(path, newline="", encoding="utf-8") as file:
+        return next(csv.reader(file), [])
+
+
+def read_rows(path, columns=()):
+    """Lazily reads a UTF-8 listings csv file and yields a (listing id,
+    location, property type, price, extras) tuple for every row, where
+    extras holds the values of the named extra columns, closing the file
+    once it is done. The file is decoded the same way as the chunks read
+    by _load_chunk, whatever the platform's default encoding
+    """
+    with open(path, newline="", encoding="utf-8") as file:
+        reader = csv.reader(file)
+        yield from _parse_rows(reader, _column_indexes(next(reader, []),
+                                                       columns))
+
+
+def _column_indexes(header, columns=()):
+    """Returns the positions of the id, location, property type, and
+    price columns and of the named extra columns in a csv header"""
+    try:
+        indexes = (header.index("id"),
+                   header.index(column_names[Categories.LOCATION]),
+                   header.index(column_names[Categories.PROPERTY_TYPE]),
+                   header.index("price"))
+    except ValueError:
+        indexes = (0, 1, 2, 3)
+    for column in columns:
+        if column not in header:
+            raise KeyError(f"{column} is not a column of the file")
+    return indexes + (tuple(header.index(column) for column in columns),)
+
+
+def _parse_rows(reader, indexes):
+    """Yields a (listing id, location, property type, price, extras)
+    tuple for every row of a csv reader"""
+    listing_id, location, property_type, price, extras = indexes
+    if not extras:
+        for row in reader:
+            if row:
+                yield int(row[listing_id]), row[location], \
+                    row[property_type], int(row[price]), ()
+        return
+    for row in reader:
+        if row:
+            yield int(row[listing_id]), row[location], row[property_type], \
+                int(row[price]), tuple(row[extra] for extra in extras)
+
+
+def _chunk_offsets(path, chunks):
+    """Splits a csv file into at most the given number of byte ranges
+    that start and end on a line boundary, skipping the header line"""
+    size = os.path.getsize(path)
+    with open(path, "rb") as file:
+        file.readline()
+        offsets = [file.tell()]
+        for i in range(1, chunks):
+            file.seek(max(size * i // chunks, offsets[-1]))
+            file.readline()
+            if file.tell() > offsets[-1]:
+                offsets.append(file.tell())
+    if offsets[-1] < size:
+        offsets.append(size)
+    return list(zip(offsets, offsets[1:]))
+
+
+def _load_chunk(path, start, end, indexes, names):
+    """Parses and aggregates the rows in one byte range of a csv file.
+    Runs in a worker process"""
+    with open(path, "rb") as file:
+        file.seek(start)
+        text = file.read(end - start).decode("utf-8")
+    return _ingest(_parse_rows(csv.reader(io.StringIO(text)), indexes),
+                   names)
+
+
+def _ingest(rows, names=()):
+    """Stores rows in new columns with the given extra column names and
+    returns them with the aggregates of every (location, property type)
+    cell, updated as each row arrives"""
+    columns = _Columns(names)
+    cells = {}
+    host = names.index(host_column) if host_column in names else None
+    for listing_id, location, property_type, rent, extras in rows:
+        _add_to_cell(cells, columns.append(listing_id, location,
+                                           property_type, rent, extras),
+                     rent, listing_id,
+                     None if host is None else extras[host])
+    return columns, cells
+
+
+def report_progress(rows, every=100000):
+    """Passes rows through unchanged, printing how many have been read
+    every so often"""
+    for count, row in enumerate(rows, 1):
+        if count % every == 0:
+            print(f"{count} lines loaded...")
+        yield row
+
+
+def _add_to_cell(cells, key, rent, listing_id, host=None):
+    """Adds the rent, listing id, and host of a row to the [count, min,
+    sum, max, sketch, sample, listings, hosts] cell stored under key.
+    The hosts sketch is None when no host is given"""
+    cell = cells.get(key)
+    if cell is None:
+        cell = cells[key] = [1, rent, rent, rent, QuantileSketch(),
+                             Reservoir(), HyperLogLog(),
+                             None if host is None else HyperLogLog()]
+        cell[4].update(rent)
+        cell[5].update(rent)
+        cell[6].update(listing_id)
+        if host is not None:
+            cell[7].update(host)
+        return
+    cell[4].update(rent)
+    cell[5].update(rent)
+    cell[6].update(listing_id)
+    if host is not None:
+        cell[7].update(host)
+    cell[0] += 1
+    if rent < cell[1]:
+        cell[1] = rent
+    cell[2] += rent
+    if rent > cell[3]:
+        cell[3] = rent
+
+
+def _merge_cell(cells, key, other):
+    """Combines a [count, min, sum, max, sketch, sample, listings,
+    hosts] cell into the one stored under key"""
+    cell = cells.get(key)
+    if cell is None:
+        cells[key] = list(other)
+        return
+    cell[4].merge(other[4])
+    cell[5].merge(other[5])
+    cell[6].merge(other[6])
+    if cell[7] is not None and other[7] is not None:
+        cell[7].merge(other[7])
+    cell[0] += other[0]
+    cell[1] = min(cell[1], other[1])
+    cell[2] += other[2]
+    cell[3] = max(cell[3], other[3])
+
+
+def _saved_cells(aggregates):
+    """Returns the cells of a dictionary from (location, property type)
+    labels to cells as lists of JSON values that start with the labels
+    """
+    return [[location, property_type, *cell[:4],
+             *(sketch and sketch.to_dict() for sketch in cell[4:])]
+            for (location, property_type), cell in aggregates.items()]
+
+
+def _restored_cells(data, saved):
+    """Returns the cells saved by _saved_cells keyed by the codes of
+    their labels in the columns"""
+    return {(data.code_of(Categories.LOCATION, location),
+             data.code_of(Categories.PROPERTY_TYPE, property_type)):
+            [*cell, QuantileSketch.from_dict(sketch),
+             Reservoir.from_dict(sample), HyperLogLog.from_dict(listings),
+             hosts and HyperLogLog.from_dict(hosts)]
+            for location, property_type, *cell, sketch, sample, listings,
+            hosts in saved}
+
+
+def _select(values, quantile):
+    """Returns the value at the given quantile of a list of values,
+    using the nearest rank"""
+    return sorted(values)[max(math.ceil(quantile * len(values)), 1) - 1]
+
+
+def _select_sorted(columns, quantile):
+    """Returns the value at the given quantile of the integers in
+    several sorted arrays, using the nearest rank, by binary searching
+    on the value"""
+    columns = [column for column in columns if len(column)]
+    rank = max(math.ceil(quantile * sum(len(column)
+                                        for column in columns)), 1)
+    if len(columns) == 1:
+        return columns[0][rank - 1]
+    low = min(column[0] for column in columns)
+    high = max(column[-1] for column in columns)
+    while low < high:
+        middle = (low + high) // 2
+        if sum(bisect.bisect_right(column, middle)
+               for column in columns) >= rank:
+            high = middle
+        else:
+            low = middle + 1
+    return low
+
+
+class QuantileSketch:
+    """A KLL sketch that estimates quantiles of a stream of values in
+    bounded memory. Sketches can be merged, and items at level h stand
+    for 2 ** h values of the stream
+    """
+
+    def __init__(self, k=200):
+        """Creates an empty sketch, where k controls its accuracy"""
+        self.k = k
+        self.levels = [[]]
+        self._offsets = [0]
+        self.size = 0
+        self.capacity = self._level_capacity(0)
+
+    def _level_capacity(self, level):
+        """Returns how many items a level holds before it is compacted"""
+        depth = len(self.levels) - level - 1
+        return math.ceil(self.k * (2 / 3) ** depth) + 1
+
+    def update(self, value):
+        """Adds a value to the sketch"""
+        self.levels[0].append(value)
+        self.size += 1
+        if self.size >= self.capacity:
+            self._compress()
+
+    def merge(self, other):
+        """Adds every value summarized by another sketch"""
+        while len(self.levels) < len(other.levels):
+            self._grow()
+        for level, items in zip(self.levels, other.levels):
+            level.extend(items)
+        self.size += other.size
+        while self.size >= self.capacity:
+            self._compress()
+
+    def _grow(self):
+        """Adds a new top level"""
+        self.levels.append([])
+        self._offsets.append(0)
+        self.capacity = sum(self._level_capacity(level)
+                            for level in range(len(self.levels)))
+
+    def _compress(self):
+        """Halves the first level that is over capacity, promoting every
+        other item of it to the level above"""
+        for level, items in enumerate(self.levels):
+            if len(items) >= self._level_capacity(level):
+                if level + 1 == len(self.levels):
+                    self._grow()
+                items.sort()
+                kept = len(items) % 2
+                promoted = items[kept + self._offsets[level]::2]
+                self._offsets[level] ^= 1
+                self.levels[level + 1].extend(promoted)
+                self.size -= len(items) - kept - len(promoted)
+                del items[kept:]
+                return
+
+    def to_dict(self):
+        """Returns the sketch as a dictionary of plain values"""
+        return {"k": self.k, "levels": self.levels,
+                "offsets": self._offsets}
+
+    @classmethod
+    def from_dict(cls, values):
+        """Recreates a sketch saved with to_dict"""
+        sketch = cls(values["k"])
+        for _ in values["levels"][1:]:
+            sketch._grow()
+        sketch.levels = values["levels"]
+        sketch._offsets = values["offsets"]
+        sketch.size = sum(len(items) for items in sketch.levels)
+        return sketch
+
+    def quantile(self, quantile):
+        """Returns an estimate of the value at the given quantile"""
+        weighted = sorted((value, 1 << level)
+                          for level, items in enumerate(self.levels)
+                          for value in items)
+        target = quantile * sum(weight for _, weight in weighted)
+        seen = 0
+        for value, weight in weighted:
+            seen += weight
+            if seen >= target:
+                return value
+        return weighted[-1][0]
+
+
+class Reservoir:
+    """A uniform random sample of at most k values of a stream, kept
+    with algorithm L so that a value that is not sampled costs one
+    comparison. Reservoirs can be merged into a sample of both streams
+    """
+    _random = random.Random(0)
+
+    def __init__(self, k=1024):
+        """Creates an empty sample of at most k values"""
+        self.k = k
+        self.values = []
+        self.seen = 0
+        self._weight = 1.0
+        self._next = 0
+
+    def update(self, value):
+        """Offers a value of the stream to the sample"""
+        self.seen += 1
+        if self.seen <= self.k:
+            self.values.append(value)
+            if self.seen == self.k:
+                self._advance()
+        elif self.seen == self._next:
+            self.values[self._random.randrange(self.k)] = value
+            self._advance()
+
+    def _advance(self):
+        """Draws the weight and the position of the next sampled value"""
+        self._weight *= math.exp(math.log(1 - self._random.random()) /
+                                 self.k)
+        self._skip()
+
+    def _skip(self):
+        """Draws the position of the next sampled value"""
+        self._next = self.seen + 1 + math.floor(
+            math.log(1 - self._random.random()) /
+            math.log1p(-self._weight))
+
+    def merge(self, other):
+        """Replaces the sample with one of the values of both streams,
+        taking each value from either sample in proportion to the size
+        of its stream"""
+        if self.seen + other.seen <= self.k:
+            self.values.extend(other.values)
+        else:
+            mine, theirs = self.values[:], other.values[:]
+            self._random.shuffle(mine)
+            self._random.shuffle(theirs)
+            left, right = self.seen, other.seen
+            values = []
+            while len(values) < self.k:
+                if self._random.random() * (left + right) < left:
+                    values.append(mine.pop())
+                    left -= 1
+                else:
+                    values.append(theirs.pop())
+                    right -= 1
+            self.values = values
+        self.seen += other.seen
+        if self.seen >= self.k:
+            self._weight = self.k / self.seen
+            self._skip()
+
+    def to_dict(self):
+        """Returns the sample as a dictionary of plain values"""
+        return {"k": self.k, "seen": self.seen, "values": self.values}
+
+    @classmethod
+    def from_dict(cls, values):
+        """Recreates a sample saved with to_dict"""
+        reservoir = cls(values["k"])
+        reservoir.values = values["values"]
+        reservoir.seen = values["seen"]
+        if reservoir.seen >= reservoir.k:
+            reservoir._weight = reservoir.k / reservoir.seen
+            reservoir._skip()
+        return reservoir
+
+    def quantile_interval(self, quantile, z):
+        """Returns the nearest rank estimate of a quantile with the
+        bounds of a confidence interval around it, taken from the order
+        statistics of the sample at z standard deviations. All three are
+        exact when the sample holds the whole stream"""
+        values = sorted(self.values)
+        size = len(values)
+        estimate = values[max(math.ceil(quantile * size), 1) - 1]
+        if size == self.seen:
+            return estimate, estimate, estimate
+        spread = z * math.sqrt(size * quantile * (1 - quantile))
+        low = min(max(math.floor(quantile * size - spread), 1), size)
+        high = min(max(math.ceil(quantile * size + spread), 1), size)
+        return estimate, values[low - 1], values[high - 1]
+
+
+@functools.lru_cache(maxsize=1 << 16)
+def _hash_label(label):
+    """Returns a 64 bit hash of a label, remembering the most recent
+    ones as the labels of a column repeat"""
+    return int.from_bytes(hashlib.blake2b(label.encode(),
+                                          digest_size=8).digest(), "little")
+
+
+def _hash64(value):
+    """Returns a well mixed 64 bit hash of a listing id or a label that
+    is the same in every process"""
+    if isinstance(value, str):
+        return _hash_label(value)
+    value = (value + 0x9E3779B97F4A7C15) & 0xFFFFFFFFFFFFFFFF
+    value = ((value ^ (value >> 30)) * 0xBF58476D1CE4E5B9) & \
+        0xFFFFFFFFFFFFFFFF
+    value = ((value ^ (value >> 27)) * 0x94D049BB133111EB) & \
+        0xFFFFFFFFFFFFFFFF
+    return value ^ (value >> 31)
+
+
+class HyperLogLog:
+    """A HyperLogLog sketch that estimates the number of distinct values
+    of a stream in 2 ** p one byte registers, however long the stream,
+    with a relative standard error of about 1.04 / sqrt(2 ** p).
+    Sketches are merged by keeping the larger of each pair of registers
+    """
+    p = 12
+
+    def __init__(self, p=None):
+        """Creates an empty sketch with 2 ** p registers"""
+        self.p = p or self.p
+        self.registers = bytearray(1 << self.p)
+
+    @classmethod
+    def relative_error(cls):
+        """Returns the relative standard error of the estimates"""
+        return 1.04 / math.sqrt(1 << cls.p)
+
+    def update(self, value):
+        """Adds a listing id or a label to the stream"""
+        hashed = _hash64(value)
+        bits = 64 - self.p
+        rank = bits + 1 - (hashed & ((1 << bits) - 1)).bit_length()
+        if rank > self.registers[hashed >> bits]:
+            self.registers[hashed >> bits] = rank
+
+    def merge(self, other):
+        """Adds the values of another sketch with the same p"""
+        self.registers = bytearray(map(max, self.registers,
+                                       other.registers))
+
+    def count(self):
+        """Returns the estimated number of distinct values, counting the
+        empty registers instead while most of them are empty"""
+        size = len(self.registers)
+        estimate = 0.7213 / (1 + 1.079 / size) * size * size / \
+            sum(2.0 ** -rank for rank in self.registers)
+        zeros = self.registers.count(0)
+        if estimate <= 2.5 * size and zeros:
+            estimate = size * math.log(size / zeros)
+        return round(estimate)
+
+    def to_dict(self):
+        """Returns the sketch as a dictionary of plain values"""
+        return {"p": self.p, "registers": self.registers.hex()}
+
+    @classmethod
+    def from_dict(cls, values):
+        """Recreates a sketch saved with to_dict"""
+        sketch = cls(values["p"])
+        sketch.registers = bytearray.fromhex(values["registers"])
+        return sketch
+
+
+def _count_distinct(sketches):
+    """Returns the estimated number of distinct values in the streams of
+    one or more sketches. Raises KeyError for a hosts sketch that was
+    not kept because the host column was not loaded"""
+    sketches = list(sketches)
+    if any(sketch is None for sketch in sketches):
+        raise KeyError(f"{host_column} was not loaded")
+    if len(sketches) == 1:
+        return sketches[0].count()
+    merged = HyperLogLog(sketches[0].p)
+    for sketch in sketches:
+        merged.merge(sketch)
+    return merged.count()
+
+
+class _Marginal:
+    """The combined count, sum, min, and max of a set of cells. The cell
+    minimums and maximums are kept sorted so that a cell can be taken
+    out again without rescanning the others
+    """
+
+    def __init__(self):
+        """Creates a marginal with no cells"""
+        self.count = 0
+        self.total = 0
+        self.minimums = []
+        self.maximums = []
+
+    def add(self, cell):
+        """Adds a [count, min, sum, max] cell"""
+        self.count += cell[0]
+        self.total += cell[2]
+        bisect.insort(self.minimums, cell[1])
+        bisect.insort(self.maximums, cell[3])
+
+    def remove(self, cell):
+        """Takes out a cell that was previously added"""
+        self.count -= cell[0]
+        self.total -= cell[2]
+        del self.minimums[bisect.bisect_left(self.minimums, cell[1])]
+        del self.maximums[bisect.bisect_left(self.maximums, cell[3])]
+
+
+def fingerprint(path, sample_size=1024 * 1024):
+    """Returns the size, modification time, and a hash of the first and
+    last sample_size bytes of a file, which identify its contents
+    without reading all of it"""
+    stat = os.stat(path)
+    digest = hashlib.blake2b(digest_size=16)
+    with open(path, "rb") as file:
+        digest.update(file.read(sample_size))
+        if stat.st_size > sample_size:
+            file.seek(max(stat.st_size - sample_size, sample_size))
+            digest.update(file.read())
+    return {"size": stat.st_size, "mtime_ns": stat.st_mtime_ns,
+            "hash": digest.hexdigest()}
+
+
+@contextlib.contextmanager
+def _replacing(path, mode="w"):
+    """Opens a temporary file next to path for writing and moves it over
+    path once it has been written, so that a reader, even one with the
+    old file memory mapped, never sees a partly written file"""
+    descriptor, temporary = tempfile.mkstemp(
+        dir=os.path.dirname(path) or ".",
+        prefix=os.path.basename(path) + ".", suffix=".tmp")
+    try:
+        with os.fdopen(descriptor, mode) as file:
+            yield file
+        os.replace(temporary, path)
+    except BaseException:
+        with contextlib.suppress(FileNotFoundError):
+            os.remove(temporary)
+        raise
+
+
+def _write_labels(file, labels):
+    """Writes a count followed by length prefixed utf-8 labels"""
+    file.write(struct.pack("<I", len(labels)))
+    for label in labels:
+        label = label.encode()
+        file.write(struct.pack("<I", len(label)) + label)
+
+
+def _read_labels(buffer, offset):
+    """Reads labels written by _write_labels and returns them with the
+    offset just past them"""
+    count, = struct.unpack_from("<I", buffer, offset)
+    offset += 4
+    labels = []
+    for _ in range(count):
+        length, = struct.unpack_from("<I", buffer, offset)
+        labels.append(buffer[offset + 4:offset + 4 + length].decode())
+        offset += 4 + length
+    return labels, offset
+
+
+class _Columns:
+    """Columnar storage for the rows of a dataset. Prices are kept in an
+    int array, and the location, property type, and any extra csv
+    columns of each row are kept as integer codes into a per-column list
+    of labels. Prices are added last, so that a thread reading the
+    first len(columns) rows sees them complete while another adds more.
+    Columns opened from a snapshot also hold the cells saved with it, in
+    the form returned by _saved_cells, until a dataset takes them
+    """
+
+    def __init__(self, names=()):
+        """Creates an empty set of columns with the given extra column
+        names"""
+        self.names = tuple(names)
+        self.dictionary = {Categories.LOCATION: [],
+                           Categories.PROPERTY_TYPE: [],
+                           **{name: [] for name in self.names}}
+        self._codes = {column: {} for column in self.dictionary}
+        self.locations = array("I")
+        self.property_types = array("I")
+        self.prices = array("i")
+        self.ids = array("q")
+        self.extras = {name: array("I") for name in self.names}
+        self.saved_cells = None
+
+    def __len__(self):
+        """Returns the number of rows"""
+        return len(self.prices)
+
+    def save(self, path, saved_cells=()):
+        """Writes the columns to a binary snapshot file made of a
+        header, the label dictionaries, the cells returned by
+        _saved_cells as JSON, and the fixed width columns"""
+        with _replacing(path, "wb") as file:
+            file.write(struct.pack("<4sHBxQ", snapshot_magic,
+                                   snapshot_version,
+                                   sys.byteorder == "little", len(self)))
+            for category in Categories:
+                _write_labels(file, self.dictionary[category])
+            _write_labels(file, self.names)
+            for name in self.names:
+                _write_labels(file, self.dictionary[name])
+            _write_labels(file, [json.dumps(list(saved_cells))])
+            file.write(b"\0" * (-file.tell() % 8))
+            for column in (self.ids, self.locations, self.property_types,
+                           self.prices, *self.extras.values()):
+                column.tofile(file)
+
+    @classmethod
+    def open(cls, path):
+        """Maps a snapshot file into memory and returns columns that
+        read from it without copying, along with the cells saved in it.
+        Raises ValueError if the file is empty, truncated, or not a
+        snapshot of this format"""
+        with open(path, "rb") as file:
+            buffer = mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ)
+        try:
+            magic, version, little, rows = struct.unpack_from("<4sHBxQ",
+                                                              buffer)
+            if magic != snapshot_magic or version != snapshot_version or \
+                    little != (sys.byteorder == "little"):
+                raise ValueError
+            offset = 16
+            dictionaries = []
+            for category in Categories:
+                labels, offset = _read_labels(buffer, offset)
+                dictionaries.append((category, labels))
+            names, offset = _read_labels(buffer, offset)
+            for name in names:
+                labels, offset = _read_labels(buffer, offset)
+                dictionaries.append((name, labels))
+            (saved_cells,), offset = _read_labels(buffer, offset)
+            saved_cells = json.loads(saved_cells)
+            if len(buffer) < offset + -offset % 8 + \
+                    rows * (20 + 4 * len(names)):
+                raise ValueError
+        except (ValueError, struct.error):
+            buffer.close()
+            raise ValueError(f"{path} is not a compatible snapshot")
+        columns = cls(names)
+        for column, labels in dictionaries:
+            for label in labels:
+                columns.encode(column, label)
+        offset += -offset % 8
+        view = memoryview(buffer)
+        columns.ids = view[offset:offset + rows * 8].cast("q")
+        offset += rows * 8
+        arrays = [view[offset + i * rows * 4:offset + (i + 1) * rows * 4]
+                  .cast("i" if i == 2 else "I")
+                  for i in range(3 + len(names))]
+        columns.locations, columns.property_types, columns.prices = \
+            arrays[:3]
+        columns.extras = dict(zip(names, arrays[3:]))
+        columns.saved_cells = saved_cells
+        return columns
+
+    def encode(self, column, label: str):
+        """Returns the code of a label, adding it to the dictionary if
+        it has not been seen before"""
+        codes = self._codes[column]
+        code = codes.get(label)
+        if code is None:
+            code = codes[label] = len(self.dictionary[column])
+            self.dictionary[column].append(label)
+        return code
+
+    def make_appendable(self):
+        """Copies any columns that are mapped from a snapshot into arrays
+        so that rows can be added to them"""
+        if isinstance(self.prices, memoryview):
+            self.ids = array("q", self.ids)
+            self.locations = array("I", self.locations)
+            self.property_types = array("I", self.property_types)
+            self.prices = array("i", self.prices)
+            self.extras = {name: array("I", codes)
+                           for name, codes in self.extras.items()}
+
+    def copy(self):
+        """Returns columns with the same labels, codes, and rows, to
+        which rows can be added without changing these"""
+        columns = _Columns(self.names)
+        for column, labels in self.dictionary.items():
+            for label in labels:
+                columns.encode(column, label)
+        columns.ids = array("q", self.ids)
+        columns.locations = array("I", self.locations)
+        columns.property_types = array("I", self.property_types)
+        columns.prices = array("i", self.prices)
+        columns.extras = {name: array("I", codes)
+                          for name, codes in self.extras.items()}
+        return columns
+
+    def append(self, listing_id: int, location: str, property_type: str,
+               price: int, extras=()):
+        """Adds a row to the end of the columns and returns its
+        (location, property type) codes. Raises ValueError, without
+        adding anything, unless there is one extra value per extra
+        column"""
+        if len(extras) != len(self.names):
+            raise ValueError(f"Expected values for the columns "
+                             f"{list(self.names)}, got {list(extras)}")
+        key = (self.encode(Categories.LOCATION, location),
+               self.encode(Categories.PROPERTY_TYPE, property_type))
+        self.ids.append(listing_id)
+        self.locations.append(key[0])
+        self.property_types.append(key[1])
+        for name, value in zip(self.names, extras):
+            self.extras[name].append(self.encode(name, value))
+        self.prices.append(price)
+        return key
+
+    def code_of(self, category: Categories, label: str):
+        """Returns the code of a label or None if it is not present"""
+        return self._codes[category].get(label)
+
+    def column(self, column):
+        """Returns the codes and the labels of a category or of a csv
+        column, which may be named by its header"""
+        for category, name in column_names.items():
+            if column == name:
+                column = category
+        if column == Categories.LOCATION:
+            return self.locations, self.dictionary[column]
+        if column == Categories.PROPERTY_TYPE:
+            return self.property_types, self.dictionary[column]
+        if column not in self.extras:
+            raise KeyError(f"{column} was not loaded")
+        return self.extras[column], self.dictionary[column]
+
+    def row(self, row_id):
+        """Returns a row as a (location, property type, price) tuple"""
+        return (self.dictionary[Categories.LOCATION][
+                    self.locations[row_id]],
+                self.dictionary[Categories.PROPERTY_TYPE][
+                    self.property_types[row_id]],
+                self.prices[row_id])
+
+    def extend(self, other):
+        """Adds the rows of other, which must have at least the same
+        extra columns, to the end of the columns and returns a list per
+        column that maps other's codes to the new ones"""
+        mappings = {column: [self.encode(column, label)
+                             for label in other.dictionary[column]]
+                    for column in self.dictionary}
+        for codes, other_codes, mapping in (
+                (self.locations, other.locations,
+                 mappings[Categories.LOCATION]),
+                (self.property_types, other.property_types,
+                 mappings[Categories.PROPERTY_TYPE]),
+                *((self.extras[name], other.extras[name], mappings[name])
+                  for name in self.names)):
+            codes.extend(mapping[code] for code in other_codes)
+        self.ids.extend(other.ids)
+        self.prices.extend(other.prices)
+        return mappings
+
+
+class _DistinctCount:
+    """The count_distinct aggregate function of a SQLite store, which
+    feeds a column into a HyperLogLog sketch"""
+
+    def __init__(self):
+        """Creates an empty sketch"""
+        self.sketch = HyperLogLog()
+
+    def step(self, value):
+        """Adds the value of one row"""
+        self.sketch.update(value)
+
+    def finalize(self):
+        """Returns the estimated number of distinct values"""
+        return self.sketch.count()
+
+
+class SQLiteStore:
+    """The rows of a dataset kept in a SQLite database file instead of in
+    memory, indexed by location and by property type. Aggregates,
+    percentiles, distinct counts, and histograms are computed, and rows
+    found and sorted, inside SQLite, on a connection of each thread's own
+    """
+    categories = {Categories.LOCATION: "location",
+                  Categories.PROPERTY_TYPE: "property_type"}
+
+    def __init__(self, path):
+        """Opens or creates the database at path"""
+        if sqlite3 is None:
+            raise RuntimeError("Python was built without sqlite3")
+        self.path = path
+        self._local = threading.local()
+        self.connection.execute("CREATE TABLE IF NOT EXISTS metadata "
+                                "(key TEXT PRIMARY KEY, value TEXT)")
+        self.names = tuple(self._metadata().get("columns", ()))
+
+    @property
+    def connection(self):
+        """Returns the calling thread's own connection to the database,
+        opening it the first time the thread asks"""
+        connection = getattr(self._local, "connection", None)
+        if connection is None:
+            connection = self._local.connection = sqlite3.connect(
+                self.path)
+            connection.create_aggregate("count_distinct", 1,
+                                        _DistinctCount)
+        return connection
+
+    def _metadata(self):
+        """Returns the values stored in the metadata table"""
+        return {key: json.loads(value) for key, value in
+                self.connection.execute("SELECT key, value FROM metadata")}
+
+    def matches(self, source, columns=()):
+        """Returns whether the database holds the rows of a source file
+        with the given extra columns"""
+        metadata = self._metadata()
+        return metadata.get("fingerprint") == fingerprint(source) and \
+            set(columns) <= set(metadata.get("columns", ()))
+
+    def import_rows(self, rows, names=(), source=None, batch_size=50000):
+        """Replaces the rows of the database with (listing id, location,
+        property type, price, extras) rows, inserted in batches within
+        a single transaction, and indexes them"""
+        rows = ((listing_id, location, property_type, price, *extras)
+                for listing_id, location, property_type, price, extras
+                in rows)
+        with self.connection:
+            self.connection.execute("DROP TABLE IF EXISTS listings")
+            self.connection.execute(
+                "CREATE TABLE listings (id INTEGER, location TEXT, "
+                "property_type TEXT, price INTEGER" +
+                "".join(f", extra{i} TEXT" for i in range(len(names))) +
+                ")")
+            insert = "INSERT INTO listings VALUES (?, ?, ?, ?" + \
+                ", ?" * len(names) + ")"
+            for batch in iter(lambda: list(itertools.islice(rows,
+                                                            batch_size)),
+                              []):
+                self.connection.executemany(insert, batch)
+            self.connection.execute("CREATE INDEX listings_location "
+                                    "ON listings (location, price)")
+            self.connection.execute("CREATE INDEX listings_property_type "
+                                    "ON listings (property_type, price)")
+            self.connection.execute("DELETE FROM metadata")
+            self.connection.executemany(
+                "INSERT INTO metadata VALUES (?, ?)",
+                [("columns", json.dumps(names)),
+                 ("fingerprint",
+                  json.dumps(source and fingerprint(source)))])
+        self.names = tuple(names)
+
+    def _column(self, column):
+        """Returns the SQL name of a category or extra column"""
+        if column in self.categories:
+            return self.categories[column]
+        if column not in self.names:
+            raise KeyError(f"{column} was not loaded")
+        return f"extra{self.names.index(column)}"
+
+    def _where(self, filters, price=None):
+        """Returns a WHERE clause and its parameters that keep the rows
+        with the filtered labels and a price from low to high"""
+        conditions, parameters = [], []
+        for column, labels in filters.items():
+            conditions.append(f"{self._column(column)} IN "
+                              f"({', '.join('?' * len(labels))})")
+            parameters.extend(labels)
+        if price is not None:
+            conditions.append("price BETWEEN ? AND ?")
+            parameters.extend(price)
+        return (" WHERE " + " AND ".join(conditions)
+                if conditions else ""), parameters
+
+    def labels(self, column):
+        """Returns the labels of a column in order of first appearance"""
+        column = self._column(column)
+        return [label for label, in self.connection.execute(
+            f"SELECT {column} FROM listings GROUP BY {column} "
+            "ORDER BY MIN(rowid)")]
+
+    def aggregate(self, columns=(), filters=None, price=None):
+        """Returns the count, min, sum, and max price of every group of
+        the given columns that has matching rows, keyed by its labels"""
+        groups = ", ".join(self._column(column) for column in columns)
+        where, parameters = self._where(filters or {}, price)
+        results = {}
+        for row in self.connection.execute(
+                f"SELECT {groups + ', ' if groups else ''}COUNT(*), "
+                f"MIN(price), SUM(price), MAX(price) FROM listings{where}" +
+                (f" GROUP BY {groups}" if groups else ""), parameters):
+            if row[len(columns)]:
+                results[tuple(row[:len(columns)])] = row[len(columns):]
+        return results
+
+    def quantile(self, quantile, columns=(), filters=None, price=None):
+        """Returns the price at a quantile of every group of the given
+        columns that has matching rows, using the nearest rank"""
+        groups = ", ".join(self._column(column) for column in columns)
+        window = f"PARTITION BY {groups} " if groups else ""
+        where, parameters = self._where(filters or {}, price)
+        return {tuple(row[:-1]): row[-1] for row in self.connection.execute(
+            f"SELECT {groups + ', ' if groups else ''}price FROM "
+            f"(SELECT *, ROW_NUMBER() OVER ({window}ORDER BY price) "
+            f"AS position, ? * COUNT(*) OVER ({window}) AS target "
+            f"FROM listings{where}) WHERE position = "
+            "MAX(CAST(target AS INTEGER) + "
+            "(target > CAST(target AS INTEGER)), 1)",
+            [quantile, *parameters])}
+
+    def count_distinct(self, state: Stats, columns=(), filters=None,
+                       price=None):
+        """Returns the estimated number of distinct listing ids or hosts
+        of every group of the given columns that has matching rows"""
+        column = "id" if state == Stats.DISTINCT_LISTINGS \
+            else self._column(host_column)
+        groups = ", ".join(self._column(column) for column in columns)
+        where, parameters = self._where(filters or {}, price)
+        return {tuple(row[:-1]): row[-1] for row in self.connection.execute(
+            f"SELECT {groups + ', ' if groups else ''}"
+            f"count_distinct({column}) FROM listings{where}" +
+            (f" GROUP BY {groups}" if groups else ""), parameters)}
+
+    def find(self, filters=None, price=None, order="rowid", limit=None):
+        """Returns the matching rows as (location, property type, price)
+        tuples, sorted by an SQL ORDER BY expression and cut to a limit
+        """
+        where, parameters = self._where(filters or {}, price)
+        if limit is not None:
+            parameters.append(limit)
+        return self.connection.execute(
+            f"SELECT location, property_type, price FROM listings{where} "
+            f"ORDER BY {order}" + (" LIMIT ?" if limit is not None else ""),
+            parameters).fetchall()
+
+    def histogram(self, edges, filters=None):
+        """Returns the number of matching rows with a price from each
+        edge up to, but not including, the next"""
+        if len(edges) < 2:
+            return []
+        where, parameters = self._where(filters or {},
+                                        (edges[0], edges[-1]))
+        return list(self.connection.execute(
+            "SELECT " + ", ".join(["COUNT(CASE WHEN price >= ? AND "
+                                   "price < ? THEN 1 END)"] *
+                                  (len(edges) - 1)) +
+            f" FROM listings{where}",
+            [edge for bucket in zip(edges, edges[1:]) for edge in bucket] +
+            parameters).fetchone())
+
+    def rows(self):
+        """Yields every row as a (listing id, location, property type,
+        price, extras) tuple in the order it was imported"""
+        for listing_id, location, property_type, price, *extras in \
+                self.connection.execute("SELECT * FROM listings "
+                                        "ORDER BY rowid"):
+            yield listing_id, location, property_type, price, tuple(extras)
+
+
+class ResultTable:
+    """The labels and values of a rendered table. A cell is None when
+    no rows match it. Estimated tables also have the (low, high) bounds
+    of a confidence interval for every cell. The columns listed in
+    counts hold numbers of listings or hosts rather than amounts of
+    money
+    """
+
+    def __init__(self, view, row_labels, column_labels, cells,
+                 currency=data_currency, intervals=None, counts=()):
+        """Creates a table of the given view"""
+        self.view = view
+        self.row_labels = row_labels
+        self.column_labels = column_labels
+        self.cells = cells
+        self.currency = currency
+        self.intervals = intervals
+        self.counts = frozenset(counts)
+
+    def to_dict(self):
+        """Returns the table as a dictionary of plain values"""
+        table = {"view": self.view, "currency": self.currency,
+                 "rows": self.row_labels, "columns": self.column_labels,
+                 "cells": self.cells}
+        if self.intervals is not None:
+            table["intervals"] = self.intervals
+        if self.counts:
+            table["counts"] = sorted(self.counts)
+        return table
+
+
+def conversion_matrix():
+    """Returns the rate from every currency in conversions to every
+    other one"""
+    return {source: {target: conversions[target] / conversions[source]
+                     for target in conversions}
+            for source in conversions}
+
+
+def convert_tables(table: ResultTable, targets, matrix=None):
+    """Returns a copy of a table in each of the target currencies, each
+    made by scaling the whole grid, apart from its count columns, with
+    one rate from the conversion matrix"""
+    rates = (matrix or conversion_matrix())[table.currency]
+    scales = {target: [1 if column in table.counts else rates[target]
+                       for column in range(len(table.column_labels))]
+              for target in targets}
+    return {target: ResultTable(table.view, table.row_labels,
+                                table.column_labels,
+                                [[None if value is None else value * scale
+                                  for value, scale
+                                  in zip(row, scales[target])]
+                                 for row in table.cells],
+                                target,
+                                None if table.intervals is None else
+                                [[None if bounds is None
+                                  else tuple(bound * scale
+                                             for bound in bounds)
+                                  for bounds, scale
+                                  in zip(row, scales[target])]
+                                 for row in table.intervals],
+                                table.counts)
+            for target in targets}
+
+
+def convert_table(table: ResultTable, target):
+    """Returns a copy of a table in the target currency"""
+    if target == table.currency:
+        return table
+    return convert_tables(table, [target])[target]
+
+
+def _currency_symbol(currency):
+    """Returns the prefix used for amounts in a currency"""
+    return "$" if currency == "USD" else currency
+
+
+def _pad(text, width):
+    """Returns text followed by enough tabs to fill the given width, or
+    by one tab if it is wider"""
+    if len(text) > width:
+        return text + "\t"
+    return text + "\t" * (((width - len(text)) // 4) +
+                          (1 if len(text) % 4 != 0 else 0))
+
+
+def write_text(table: ResultTable, file):
+    """Writes a table to a file as tab aligned text"""
+    cross_table = table.view == "cross_table"
+    symbol = _currency_symbol(table.currency)
+    if cross_table:
+        lines = ["\t\t\t\t" + "".join(f"{column}\t"
+                                      for column in table.column_labels)]
+    else:
+        lines = ["\t\t\t\t\t" + "\t\t\t".join(table.column_labels)]
+    for label, row, bounds in zip(table.row_labels, table.cells,
+                                  table.intervals or table.cells):
+        line = [_pad(str(label), 16 if cross_table else 20)]
+        for column, (value, interval) in enumerate(zip(row, bounds)):
+            prefix, digits = ("", 0) if column in table.counts \
+                else (f"{symbol} ", 2)
+            if value is None:
+                line.append(_pad(f"{prefix}N/A", 16) if cross_table
+                            else "N/A\t\t\t\t\t")
+            elif table.intervals is not None:
+                half = max(value - interval[0], interval[1] - value)
+                line.append(_pad(f"{prefix}{value:.{digits}f} +/- "
+                                 f"{half:.{digits}f}", 24))
+            else:
+                line.append(_pad(f"{prefix}{value:.{digits}f}", 16))
+        lines.append("".join(line))
+    file.write("\n".join(lines) + ("\n\n\n" if cross_table else "\n\n"))
+
+
+def write_csv(table: ResultTable, file):
+    """Writes a table to a file as csv with a header row"""
+    writer = csv.writer(file)
+    digits = [0 if column in table.counts else 2
+              for column in range(len(table.column_labels))]
+    if table.intervals is not None:
+        writer.writerow(["", *(title for column in table.column_labels
+                               for title in (column, f"{column} low",
+                                             f"{column} high"))])
+        writer.writerows(
+            [label, *(text for value, bounds, places
+                      in zip(row, intervals, digits)
+                      for text in (("", "", "") if value is None else
+                                   (f"{value:.{places}f}",
+                                    f"{bounds[0]:.{places}f}",
+                                    f"{bounds[1]:.{places}f}")))]
+            for label, row, intervals in zip(table.row_labels, table.cells,
+                                             table.intervals))
+        return
+    writer.writerow(["", *table.column_labels])
+    writer.writerows([label, *("" if value is None else f"{value:.{places}f}"
+                               for value, places in zip(row, digits))]
+                     for label, row in zip(table.row_labels, table.cells))
+
+
+def write_json(table: ResultTable, file):
+    """Writes a table to a file as a JSON object"""
+    json.dump(table.to_dict(), file)
+    file.write("\n")
+
+
+formatters = {"text": write_text, "csv": write_csv, "json": write_json}
+
+
+def _column_key(column):
+    """Returns the category a column header names, or the column"""
+    for category, name in column_names.items():
+        if column == name:
+            return category
+    return column
+
+
+def _label_filters(location=None, property_type=None):
+    """Returns the filters that keep the rows with a location and a
+    property type, either of which matches any label when None"""
+    return {category: {label} for category, label
+            in ((Categories.LOCATION, location),
+                (Categories.PROPERTY_TYPE, property_type))
+            if label is not None}
+
+
+def _unpack_key(key, dictionaries, radixes):
+    """Returns the labels of a key packed from the codes of several
+    columns"""
+    labels = []
+    for dictionary, radix in zip(reversed(dictionaries), reversed(radixes)):
+        key, code = divmod(key, radix)
+        labels.append(dictionary[code])
+    return tuple(reversed(labels))
+
+
+class Query:
+    """A lazily evaluated query over a dataset. Every method returns a
+    new query and no rows are read until execute, when a planner picks
+    the cheapest of the maintained marginals, the cell aggregates, the
+    price index, or a single fused scan that can answer it
+    """
+
+    def __init__(self, dataset, filters=None, price=None, columns=(),
+                 stats=(Stats.MIN, Stats.AVG, Stats.MAX),
+                 approximate=False):
+        """Creates a query of every row of a dataset"""
+        self.dataset = dataset
+        self.filters = filters or {}
+        self.price = price
+        self.columns = columns
+        self.stats = stats
+        self.approximate = approximate
+
+    def _replace(self, **parts):
+        """Returns a copy of the query with some of its parts replaced"""
+        return Query(self.dataset,
+                     **{"filters": self.filters, "price": self.price,
+                        "columns": self.columns, "stats": self.stats,
+                        "approximate": self.approximate, **parts})
+
+    def where(self, location=None, property_type=None, price=None,
+              **columns):
+        """Returns the query restricted to the rows whose location,
+        property type, and named csv columns have the given label or one
+        of a collection of labels, and whose price is from low to high
+        when a (low, high) pair is given"""
+        filters = dict(self.filters)
+        for column, labels in ((Categories.LOCATION, location),
+                               (Categories.PROPERTY_TYPE, property_type),
+                               *columns.items()):
+            if labels is None:
+                continue
+            column = _column_key(column)
+            labels = frozenset([labels] if isinstance(labels, str)
+                               else labels)
+            filters[column] = filters[column] & labels \
+                if column in filters else labels
+        if price is not None and self.price is not None:
+            price = (max(price[0], self.price[0]),
+                     min(price[1], self.price[1]))
+        return self._replace(filters=filters, price=price or self.price)
+
+    def group_by(self, *columns):
+        """Returns the query grouped by Categories or csv column names"""
+        return self._replace(columns=tuple(_column_key(column)
+                                           for column in columns))
+
+    def agg(self, *stats, approximate=False):
+        """Returns the query computing the given Stats of every group.
+        Percentiles are estimated from sketches if approximate is set,
+        and distinct counts always are"""
+        return self._replace(stats=stats, approximate=approximate)
+
+    def plan(self):
+        """Returns the name of the way execute will answer the query"""
+        dataset = self.dataset
+        if dataset._store is not None:
+            return "sqlite"
+        percentiles = not self.approximate and \
+            any(state in quantiles for state in self.stats)
+        if not set(self.filters) | set(self.columns) <= set(Categories):
+            return "scan" if self._indexed_rows() is None else "index_scan"
+        if self.price is None and not percentiles:
+            if len(self.columns) == 1 and \
+                    set(self.stats) <= {Stats.MIN, Stats.AVG, Stats.MAX} \
+                    and all(self.filters.get(category) == labels
+                            for category, labels
+                            in dataset._active_labels.items()):
+                return "marginals"
+            return "aggregates"
+        if percentiles or dataset._price_index is not None:
+            return "price_index"
+        return "scan" if self._indexed_rows() is None else "index_scan"
+
+    @instrumented
+    def execute(self):
+        """Returns the values of the stats of every group that has
+        matching rows, keyed by the tuple of its labels"""
+        if not self.dataset._data and not self.dataset._cells:
+            raise DataSet.EmptyDatasetError
+        plan = self.plan()
+        if plan == "sqlite":
+            return self._from_store()
+        if plan == "marginals":
+            return self._from_marginals()
+        if plan == "aggregates":
+            return self._from_aggregates()
+        if plan == "price_index":
+            return self._from_price_index()
+        self.dataset._require_rows(self.filters, self.price)
+        return self._scan(self._indexed_rows())
+
+    def _matches(self, labels):
+        """Returns whether a cell's labels pass the filters"""
+        return all(labels[column] in allowed
+                   for column, allowed in self.filters.items())
+
+    def _statistics(self, count, minimum, total, maximum, quantile,
+                    distinct):
+        """Returns the stats of a group, calling total, quantile, and
+        distinct only for the stats that need them"""
+        return tuple(quantile(quantiles[state]) if state in quantiles
+                     else distinct(state) if state in distinct_counts
+                     else minimum if state == Stats.MIN
+                     else maximum if state == Stats.MAX
+                     else total() / count for state in self.stats)
+
+    def _from_store(self):
+        """Answers the query with one GROUP BY query in the dataset's
+        SQLite store, and one more for each percentile"""
+        store = self.dataset._store
+        percentiles = {quantiles[state]: store.quantile(
+                           quantiles[state], self.columns, self.filters,
+                           self.price)
+                       for state in self.stats if state in quantiles}
+        distinct = {state: store.count_distinct(state, self.columns,
+                                                self.filters, self.price)
+                    for state in self.stats if state in distinct_counts}
+        return {key: self._statistics(
+                    count, minimum, lambda: total, maximum,
+                    lambda quantile: percentiles[quantile][key],
+                    lambda state: distinct[state][key])
+                for key, (count, minimum, total, maximum)
+                in store.aggregate(self.columns, self.filters,
+                                   self.price).items()}
+
+    def _from_marginals(self):
+        """Answers the query from the marginals of the active labels"""
+        category = self.columns[0]
+        results = {}
+        for label in self.filters[category]:
+            try:
+                values = self.dataset._table_statistics(category, label)
+            except DataSet.NoMatchingItems:
+                continue
+            results[(label,)] = tuple(values[state.value]
+                                      for state in self.stats)
+        return results
+
+    def _from_aggregates(self):
+        """Answers the query by combining the aggregates of its cells"""
+        groups = {}
+        for (location, property_type), cell in \
+                self.dataset._group_aggregates().items():
+            labels = {Categories.LOCATION: location,
+                      Categories.PROPERTY_TYPE: property_type}
+            if self._matches(labels):
+                groups.setdefault(tuple(labels[column]
+                                        for column in self.columns),
+                                  []).append(cell)
+        results = {}
+        for key, cells in groups.items():
+            sketch = cells[0][4]
+            if len(cells) > 1 and any(state in quantiles
+                                      for state in self.stats):
+                sketch = QuantileSketch()
+                for cell in cells:
+                    sketch.merge(cell[4])
+            results[key] = self._statistics(
+                sum(cell[0] for cell in cells),
+                min(cell[1] for cell in cells),
+                lambda: sum(cell[2] for cell in cells),
+                max(cell[3] for cell in cells), sketch.quantile,
+                lambda state: _count_distinct(
+                    cell[distinct_counts[state]] for cell in cells))
+        return results
+
+    def _from_price_index(self):
+        """Answers the query from the sorted rents of its cells, cut down
+        to the price range by binary search"""
+        groups = {}
+        for (location, property_type), (prices, row_ids) in \
+                self.dataset._price_index_for(self.filters,
+                                              self.price).items():
+            labels = {Categories.LOCATION: location,
+                      Categories.PROPERTY_TYPE: property_type}
+            if not self._matches(labels):
+                continue
+            if self.price is not None:
+                start = bisect.bisect_left(prices, self.price[0])
+                end = bisect.bisect_right(prices, self.price[1])
+                prices, row_ids = prices[start:end], row_ids[start:end]
+            if prices:
+                groups.setdefault(tuple(labels[column]
+                                        for column in self.columns),
+                                  []).append((prices, row_ids))
+        return {key: self._statistics(
+                    sum(len(prices) for prices, _ in group),
+                    min(prices[0] for prices, _ in group),
+                    lambda: sum(sum(prices) for prices, _ in group),
+                    max(prices[-1] for prices, _ in group),
+                    lambda quantile: _select_sorted(
+                        [prices for prices, _ in group], quantile),
+                    lambda state: self._count_distinct_rows(
+                        state, itertools.chain.from_iterable(
+                            row_ids for _, row_ids in group)))
+                for key, group in groups.items()}
+
+    def _count_distinct_rows(self, state: Stats, row_ids):
+        """Returns the estimated number of distinct listing ids or hosts
+        of the given rows, from a sketch built the same way as the ones
+        kept for every cell"""
+        data = self.dataset._data
+        sketch = HyperLogLog()
+        if state == Stats.DISTINCT_LISTINGS:
+            for row_id in row_ids:
+                sketch.update(data.ids[row_id])
+        else:
+            codes, labels = data.column(host_column)
+            for row_id in row_ids:
+                sketch.update(labels[codes[row_id]])
+        return sketch.count()
+
+    def _indexed_rows(self):
+        """Returns the sorted ids of the rows with the filtered labels of
+        the category that matches fewest rows, when the label indexes
+        have been built, and otherwise None"""
+        indexes = self.dataset._indexes
+        if indexes is None:
+            return None
+        candidates = [[indexes[category][label] for label in labels
+                       if label in indexes[category]]
+                      for category, labels in self.filters.items()
+                      if category in indexes]
+        if not candidates:
+            return None
+        return heapq.merge(*min(candidates, key=lambda row_ids: sum(
+            len(ids) for ids in row_ids)))
+
+    def _scan(self, row_ids=None):
+        """Answers the query in one pass over the given rows, or all of
+        them, checking every filter and packing the codes of the group
+        columns into one integer key per row"""
+        data = self.dataset._data
+        loaded = len(data)
+        filters = []
+        for column, labels in self.filters.items():
+            codes, dictionary = data.column(column)
+            filters.append((codes, {code for code, label
+                                    in enumerate(dictionary)
+                                    if label in labels}))
+        codes, dictionaries = zip(*(data.column(column)
+                                    for column in self.columns)) \
+            if self.columns else ((), ())
+        radixes = [max(len(dictionary), 1) for dictionary in dictionaries]
+        low, high = self.price or (-math.inf, math.inf)
+        keep_rents = any(state in quantiles for state in self.stats)
+        keep_rows = any(state in distinct_counts for state in self.stats)
+        prices = data.prices
+        groups = {}
+        scanned = 0
+        for row_id in range(loaded) if row_ids is None else row_ids:
+            scanned += 1
+            rent = prices[row_id]
+            if not low <= rent <= high:
+                continue
+            for column, allowed in filters:
+                if column[row_id] not in allowed:
+                    break
+            else:
+                key = 0
+                for column, radix in zip(codes, radixes):
+                    key = key * radix + column[row_id]
+                group = groups.get(key)
+                if group is None:
+                    groups[key] = [1, rent, rent, rent, [rent], [row_id]]
+                    continue
+                group[0] += 1
+                if rent < group[1]:
+                    group[1] = rent
+                group[2] += rent
+                if rent > group[3]:
+                    group[3] = rent
+                if keep_rents:
+                    group[4].append(rent)
+                if keep_rows:
+                    group[5].append(row_id)
+        _count_rows(scanned)
+        return {_unpack_key(key, dictionaries, radixes): self._statistics(
+                    count, minimum, lambda: total, maximum,
+                    lambda quantile: _select(rents, quantile),
+                    lambda state: self._count_distinct_rows(state, rows))
+                for key, (count, minimum, total, maximum, rents, rows)
+                in groups.items()}
 
 
 class DataSet:
     """This class creates a copyright and header for the data"""
     copyright = "No copyright has been set"
+    cache_size = 64
 
     def __init__(self, header=""):
         """This constructor creates a new Dataset object"""
@@ -36,54 +1635,209 @@ class DataSet:
         except ValueError:
             self._header = ""
         self._data = None
+        self._cells = None
+        self._aggregates = None
+        self._marginals = None
+        self._indexes = None
+        self._price_index = None
+        self._listing_ids = None
+        self._summary_path = None
+        self._partitions = None
+        self._store = None
+        self._building = threading.RLock()
+        self._cache = OrderedDict()
+        self.cache_hits = 0
+        self.cache_misses = 0
         self._labels = {Categories.LOCATION: set(),
                         Categories.PROPERTY_TYPE: set()}
         self._active_labels = {Categories.LOCATION: set(),
                                Categories.PROPERTY_TYPE: set()}
 
+    @instrumented
     def _initialize_sets(self):
         """Initializes the labels and active labels"""
-        if not self._data:
+        if not self._data and not self._cells:
             raise self.EmptyDatasetError
-        for data in self._data:
-            self._labels[Categories.LOCATION].add(data[0])
-            self._labels[Categories.PROPERTY_TYPE].add(data[1])
-            self._active_labels[Categories.LOCATION].add(data[0])
-            self._active_labels[Categories.PROPERTY_TYPE].add(data[1])
-
-    def display_cross_tables(self, state: Stats):
-        """Displays a table of either min, max, and avg data"""
-
-        if not self._data:
+        self._summary_path = None
+        self._partitions = None
+        self._store = None
+        self._aggregates = None
+        self._marginals = None
+        self._indexes = None
+        self._price_index = None
+        self._listing_ids = None
+        self._cache = OrderedDict()
+        self._labels = {category: set() for category in Categories}
+        self._active_labels = {category: set() for category in Categories}
+        for category in Categories:
+            self._labels[category].update(self._data.dictionary[category])
+            self._active_labels[category].update(
+                self._data.dictionary[category])
+
+    def _cached(self, key, compute, active_labels):
+        """Returns the result stored in the cache under a key together
+        with the active labels, computing and storing it if it is
+        missing and evicting the least recently used result when the
+        cache is full. Threads may share the cache without a lock, as a
+        result evicted by another thread is simply computed again"""
+        key += (frozenset(active_labels[Categories.LOCATION]),
+                frozenset(active_labels[Categories.PROPERTY_TYPE]))
+        cache = self._cache
+        try:
+            result = cache[key]
+            cache.move_to_end(key)
+        except KeyError:
+            self.cache_misses += 1
+            result = cache[key] = compute()
+            while len(cache) > self.cache_size:
+                try:
+                    cache.popitem(last=False)
+                except KeyError:
+                    break
+            return result
+        self.cache_hits += 1
+        return result
+
+    def cache_info(self):
+        """Returns the hit and miss counts and the size of the result
+        cache"""
+        return {"hits": self.cache_hits, "misses": self.cache_misses,
+                "size": len(self._cache), "max_size": self.cache_size}
+
+    def query(self):
+        """Returns a lazily evaluated query of every row"""
+        return Query(self)
+
+    @instrumented
+    def cross_table(self, state: Stats, approximate=False,
+                    active_labels=None):
+        """Returns a table of either min, max, avg, percentile, or
+        distinct count data for every active location and property type.
+        Percentiles are estimated from sketches if approximate is set,
+        and a dictionary of active labels may be given in place of the
+        dataset's own"""
+        if not self._data and not self._cells:
             raise self.EmptyDatasetError
-        list_of_locations = list(self._active_labels[
-                                     Categories.LOCATION])
-        list_of_property_types = list(self._active_labels[
+        active_labels = active_labels or self._active_labels
+        return self._cached(("cross_table", state, approximate),
+                            lambda: self._compute_cross_table(
+                                state, approximate, active_labels),
+                            active_labels)
+
+    def _compute_cross_table(self, state: Stats, approximate,
+                             active_labels):
+        """Builds the table returned by cross_table"""
+        list_of_locations = list(active_labels[Categories.LOCATION])
+        list_of_property_types = list(active_labels[
                                           Categories.PROPERTY_TYPE])
-        table = "\t\t\t\t"
-        for property_type in list_of_property_types:
-            table += f"{property_type}\t"
-
-        table += "\n"
-        for location in list_of_locations:
-            table += f"{location}" + ("\t" *
-                             (((16 - len(location)) // 4) +
-                              (1 if len(location) % 4 != 0 else 0)))
-            for property_type in list_of_property_types:
-                try:
-                    rents = self._cross_table_statistics(location,
-                                                         property_type)[
-                        state.value
-                    ]
-                    table += f"$ {rents:.2f}" + ("\t" *
-                             (((16 - len(f"$ {rents:.2f}")) // 4) +
-                              (1 if len(f"$ {rents:.2f}") % 4 != 0
-                               else 0)))
-                except DataSet.NoMatchingItems:
-                    table += f"$ N/A\t\t\t"
-            table += "\n"
-        print(table)
-        print("")
+        results = self.query().where(
+            list_of_locations, list_of_property_types).group_by(
+            Categories.LOCATION, Categories.PROPERTY_TYPE).agg(
+            state, approximate=approximate).execute()
+        return ResultTable("cross_table", list_of_locations,
+                           list_of_property_types,
+                           [[results.get((location, property_type),
+                                         (None,))[0]
+                             for property_type in list_of_property_types]
+                            for location in list_of_locations],
+                           counts=range(len(list_of_property_types))
+                           if state in distinct_counts else ())
+
+    @instrumented
+    def display_cross_tables(self, state: Stats, approximate=False,
+                             file=None):
+        """Displays a table of either min, max, avg, or percentile data
+        in the home currency. Percentiles are estimated from sketches if
+        approximate is set"""
+        write_text(convert_table(self.cross_table(state, approximate),
+                                 home_currency or data_currency),
+                   file or sys.stdout)
+
+    @instrumented
+    def estimate_cross_table(self, state: Stats, confidence=0.95,
+                             max_error=None, time_budget=None,
+                             active_labels=None):
+        """Returns a cross table whose percentiles are estimated from the
+        sample kept for each cell, with the bounds of a confidence
+        interval for every value. The min, avg, and max are exact, as
+        every cell keeps them while loading, and distinct counts are
+        bounded by the standard error of their sketches, which no budget
+        improves. When a budget is given, cells whose interval is wider
+        than max_error times their value are computed exactly, widest
+        first, until time_budget seconds have passed. Cells are computed
+        one at a time from SQLite or the price index, which is only built
+        within a time budget when the rest of it covers building it at
+        price_index_rows_per_second, and rows that are not in memory are
+        not read within a time budget"""
+        start = time.perf_counter()
+        if not self._data and not self._cells:
+            raise self.EmptyDatasetError
+        active_labels = active_labels or self._active_labels
+        z = statistics.NormalDist().inv_cdf((1 + confidence) / 2)
+        locations = list(active_labels[Categories.LOCATION])
+        property_types = list(active_labels[Categories.PROPERTY_TYPE])
+        aggregates = self._group_aggregates()
+        cells, intervals, wide = [], [], []
+        for row, location in enumerate(locations):
+            values, bounds = [], []
+            for column, property_type in enumerate(property_types):
+                cell = aggregates.get((location, property_type))
+                if cell is None:
+                    values.append(None)
+                    bounds.append(None)
+                    continue
+                if state in distinct_counts:
+                    value = self._cell_statistic(
+                        location, property_type, state)
+                    half = z * HyperLogLog.relative_error() * value
+                    low, high = value - half, value + half
+                elif state not in quantiles:
+                    value = low = high = self._cross_table_statistics(
+                        location, property_type)[state.value]
+                elif cell[5] is None:
+                    value = low = high = self._cell_statistic(
+                        location, property_type, state)
+                else:
+                    value, low, high = cell[5].quantile_interval(
+                        quantiles[state], z)
+                values.append(value)
+                bounds.append((low, high))
+                error = max(value - low, high - value) / abs(value) \
+                    if value else (0 if low == high else math.inf)
+                if (max_error is not None or time_budget is not None) \
+                        and error > (max_error or 0) and \
+                        state not in distinct_counts:
+                    wide.append((error, row, column))
+            cells.append(values)
+            intervals.append(bounds)
+        if time_budget is not None and self._store is None and \
+                (self._price_index is None or self._partitions is not None):
+            in_memory = self._summary_path is None and \
+                self._partitions is None
+            if not in_memory or len(self._data) / \
+                    price_index_rows_per_second > \
+                    time_budget - (time.perf_counter() - start):
+                wide = []
+        for _, row, column in sorted(wide, reverse=True):
+            if time_budget is not None and \
+                    time.perf_counter() - start >= time_budget:
+                break
+            value = self._cell_statistic(
+                locations[row], property_types[column], state)
+            cells[row][column] = value
+            intervals[row][column] = (value, value)
+        return ResultTable("cross_table", locations, property_types, cells,
+                           intervals=intervals,
+                           counts=range(len(property_types))
+                           if state in distinct_counts else ())
+
+    def display_estimates(self, state: Stats, confidence=0.95,
+                          max_error=None, time_budget=None, file=None):
+        """Displays an estimated cross table with the half width of the
+        confidence interval of every value, in the home currency"""
+        write_text(convert_table(self.estimate_cross_table(
+            state, confidence, max_error, time_budget),
+            home_currency or data_currency), file or sys.stdout)
 
     @property
     def header(self):
@@ -98,6 +1852,7 @@ class DataSet:
         else:
             raise ValueError
 
+    @instrumented
     def _cross_table_statistics(self, descriptor_one: str,
                                 descriptor_two: str):
         """ Filters out data depending on the users choice and
@@ -105,20 +1860,289 @@ class DataSet:
         """
         if self._data is None:
             raise DataSet.EmptyDatasetError("The dataset is empty")
-        found_data = [data for data in self._data if data[0] ==
-                      descriptor_one and data[1] == descriptor_two]
-
-        if len(found_data) == 0:
+        try:
+            count, minimum, total, maximum, *_ = self._group_aggregates()[
+                (descriptor_one, descriptor_two)]
+        except KeyError:
             raise DataSet.NoMatchingItems("Found no items matching "
                                           "your search")
+        return minimum, total / count, maximum, count
+
+    def _cell_statistic(self, location: str, property_type: str,
+                        state: Stats, approximate=False):
+        """Returns one statistic of the rents of a location and property
+        type. Percentiles are exact unless approximate is set, in which
+        case they are read from the cell's quantile sketch"""
+        results = self.query().where(location, property_type).agg(
+            state, approximate=approximate).execute()
+        if () not in results:
+            raise DataSet.NoMatchingItems("Found no items matching "
+                                          "your search")
+        return results[()][0]
 
-        rents = [int(data[2]) for data in found_data]
-        return min(rents), sum(rents) / len(rents), max(rents), \
-               len(found_data)
+    @instrumented
+    def _group_aggregates(self):
+        """Returns the count, min, sum, and max rent of every location
+        and property type pair, computed in a single pass over the data
+        """
+        if self._cells is None:
+            _count_rows(len(self._data))
+            cells = {}
+            hosts = itertools.repeat(None)
+            if host_column in self._data.names:
+                codes, labels = self._data.column(host_column)
+                hosts = (labels[code] for code in codes)
+            for key, rent, listing_id, host in zip(
+                    zip(self._data.locations, self._data.property_types),
+                    self._data.prices, self._data.ids, hosts):
+                _add_to_cell(cells, key, rent, listing_id, host)
+            self._cells = cells
+        if self._aggregates is None:
+            locations = self._data.dictionary[Categories.LOCATION]
+            property_types = self._data.dictionary[
+                Categories.PROPERTY_TYPE]
+            self._aggregates = {
+                (locations[location], property_types[property_type]): cell
+                for (location, property_type), cell
+                in self._cells.items()}
+        return self._aggregates
+
+    @instrumented
+    def build_indexes(self, filters=None):
+        """Builds an index from every location and property type label
+        to the sorted ids of the rows that have it. For partitioned data
+        only the partitions that can match the filters need be read"""
+        with self._building:
+            self._require_rows(filters)
+            _count_rows(len(self._data))
+            indexes = {}
+            for category, column in ((Categories.LOCATION,
+                                      self._data.locations),
+                                     (Categories.PROPERTY_TYPE,
+                                      self._data.property_types)):
+                row_ids = [array("I")
+                           for _ in self._data.dictionary[category]]
+                for row_id, code in enumerate(column):
+                    row_ids[code].append(row_id)
+                indexes[category] = dict(zip(
+                    self._data.dictionary[category], row_ids))
+            self._indexes = indexes
+
+    def _indexes_for(self, filters=None):
+        """Returns the label indexes, first building them under the
+        dataset's lock if they have not been built since the rows that
+        can match the filters were loaded. Once built over rows that are
+        all in memory, they are returned without taking the lock"""
+        indexes = self._indexes
+        if indexes is not None and self._partitions is None:
+            return indexes
+        with self._building:
+            self._require_rows(filters)
+            if self._indexes is None:
+                self.build_indexes(filters)
+            return self._indexes
+
+    def _matching_row_ids(self, location=None, property_type=None):
+        """Returns the sorted ids of the rows that match the given
+        labels, intersecting the indexes when both are given"""
+        indexes = self._indexes_for(_label_filters(location, property_type))
+        found = [indexes[category].get(label, array("I"))
+                 for category, label in ((Categories.LOCATION, location),
+                                         (Categories.PROPERTY_TYPE,
+                                          property_type))
+                 if label is not None]
+        if not found:
+            return range(len(self._data))
+        if len(found) == 1:
+            return found[0]
+        smaller, larger = sorted(found, key=len)
+        row_ids = array("I")
+        low = 0
+        for row_id in smaller:
+            low = bisect.bisect_left(larger, row_id, low)
+            if low == len(larger):
+                break
+            if larger[low] == row_id:
+                row_ids.append(row_id)
+        return row_ids
+
+    def find_rows(self, location=None, property_type=None):
+        """Returns the rows that match the given location and property
+        type as (location, property type, price) tuples"""
+        if self._store is not None:
+            return self._store.find(_label_filters(location, property_type))
+        return [self._data.row(row_id) for row_id in
+                self._matching_row_ids(location, property_type)]
+
+    def find_statistics(self, location=None, property_type=None):
+        """Returns the min, average, and max rent and the number of rows
+        that match the given location and property type"""
+        if self._store is not None:
+            found = self._store.aggregate(
+                filters=_label_filters(location, property_type)).get(())
+            if found is None:
+                raise self.NoMatchingItems("Found no items matching your "
+                                           "search")
+            count, minimum, total, maximum = found
+            return minimum, total / count, maximum, count
+        row_ids = self._matching_row_ids(location, property_type)
+        prices = self._data.prices
+        rents = [prices[row_id] for row_id in row_ids]
+        if not rents:
+            raise self.NoMatchingItems("Found no items matching your "
+                                       "search")
+        return min(rents), sum(rents) / len(rents), max(rents), len(rents)
+
+    @instrumented
+    def build_price_index(self, filters=None, price=None):
+        """Builds, for every location and property type pair, its rents
+        in sorted order along with the ids of their rows. For partitioned
+        data only the partitions that can match the filters and the
+        (low, high) price range need be read"""
+        with self._building:
+            self._require_rows(filters, price)
+            _count_rows(len(self._data))
+            row_ids = {}
+            for row_id, key in enumerate(zip(self._data.locations,
+                                             self._data.property_types)):
+                row_ids.setdefault(key, []).append(row_id)
+            prices = self._data.prices
+            locations = self._data.dictionary[Categories.LOCATION]
+            property_types = self._data.dictionary[
+                Categories.PROPERTY_TYPE]
+            price_index = {}
+            for (location, property_type), ids in row_ids.items():
+                ids.sort(key=prices.__getitem__)
+                price_index[(locations[location],
+                             property_types[property_type])] = (
+                    array("i", [prices[row_id] for row_id in ids]),
+                    array("I", ids))
+            self._price_index = price_index
+
+    def _price_index_for(self, filters=None, price=None):
+        """Returns the price index, first building it under the dataset's
+        lock if it has not been built since the rows that can match the
+        filters and the (low, high) price range were loaded. Once built
+        over rows that are all in memory, it is returned without taking
+        the lock"""
+        price_index = self._price_index
+        if price_index is not None and self._partitions is None:
+            return price_index
+        with self._building:
+            self._require_rows(filters, price)
+            if self._price_index is None:
+                self.build_price_index(filters, price)
+            return self._price_index
+
+    def _price_cells(self, locations=None, property_types=None, price=None,
+                     filters=None):
+        """Returns the sorted rents and row ids of every cell whose
+        location and property type are in the given sets, where None
+        matches any label. Partitions are read only when they can match
+        the labels, the (low, high) price range, and any other filters
+        """
+        filters = {**(filters or {}),
+                   **{category: labels for category, labels
+                      in ((Categories.LOCATION, locations),
+                          (Categories.PROPERTY_TYPE, property_types))
+                      if labels is not None}}
+        price_index = self._price_index_for(filters, price)
+        locations = filters.get(Categories.LOCATION)
+        property_types = filters.get(Categories.PROPERTY_TYPE)
+        return [cell for (location, property_type), cell
+                in price_index.items()
+                if (locations is None or location in locations) and
+                (property_types is None or property_type in property_types)]
+
+    def count_in_range(self, low, high, location=None, property_type=None):
+        """Returns how many listings of the given location and property
+        type, or of any when None, have a rent from low to high"""
+        if self._store is not None:
+            return self._store.aggregate(
+                filters=_label_filters(location, property_type),
+                price=(low, high)).get((), (0,))[0]
+        return sum(bisect.bisect_right(prices, high) -
+                   bisect.bisect_left(prices, low)
+                   for prices, _ in self._price_cells(
+                       None if location is None else {location},
+                       None if property_type is None else {property_type}))
+
+    def price_histogram(self, edges, location=None, property_type=None):
+        """Returns the number of matching listings in each bucket from
+        one edge up to, but not including, the next"""
+        if self._store is not None:
+            return self._store.histogram(
+                edges, _label_filters(location, property_type))
+        counts = [0] * (len(edges) - 1)
+        for prices, _ in self._price_cells(
+                None if location is None else {location},
+                None if property_type is None else {property_type}):
+            positions = [bisect.bisect_left(prices, edge)
+                         for edge in edges]
+            for i in range(len(counts)):
+                counts[i] += positions[i + 1] - positions[i]
+        return counts
+
+    def top_listings(self, k=20, location=None, property_type=None,
+                     highest=True):
+        """Returns the k most expensive, or cheapest, matching listings
+        as (location, property type, price) tuples"""
+        if self._store is not None:
+            return self._store.find(
+                _label_filters(location, property_type),
+                order="price DESC" if highest else "price", limit=k)
+        cells = self._price_cells(
+            None if location is None else {location},
+            None if property_type is None else {property_type})
+        if highest:
+            candidates = [zip(reversed(prices[-k:]), reversed(ids[-k:]))
+                          for prices, ids in cells]
+        else:
+            candidates = [zip(prices[:k], ids[:k]) for prices, ids in cells]
+        return [self._data.row(row_id) for _, row_id in
+                itertools.islice(heapq.merge(*candidates, reverse=highest),
+                                 k)]
+
+    @instrumented
+    def group_by(self, *columns):
+        """Returns the min, average, and max rent and the number of rows
+        for every combination of labels of the given columns. Columns
+        are Categories or csv column names kept by load_file. The codes
+        of each row are packed into one integer key so the rows are
+        aggregated in a single hash aggregation pass, or by a GROUP BY
+        query when the rows are in SQLite"""
+        if self._store is not None:
+            return {key: (minimum, total / count, maximum, count)
+                    for key, (count, minimum, total, maximum)
+                    in self._store.aggregate(tuple(map(_column_key,
+                                                       columns))).items()}
+        self._require_rows()
+        _count_rows(len(self._data))
+        codes, dictionaries = zip(*(self._data.column(column)
+                                    for column in columns))
+        radixes = [max(len(dictionary), 1) for dictionary in dictionaries]
+        keys = codes[0]
+        for column, radix in zip(codes[1:], radixes[1:]):
+            keys = [key * radix + code for key, code in zip(keys, column)]
+        groups = {}
+        for key, rent in zip(keys, self._data.prices):
+            group = groups.get(key)
+            if group is None:
+                groups[key] = [1, rent, rent, rent]
+                continue
+            group[0] += 1
+            if rent < group[1]:
+                group[1] = rent
+            group[2] += rent
+            if rent > group[3]:
+                group[3] = rent
+        return {_unpack_key(key, dictionaries, radixes):
+                (minimum, total / count, maximum, count)
+                for key, (count, minimum, total, maximum) in groups.items()}
 
     def load_default_data(self):
         """Loads a dataset and stores it into the dataset variable"""
-        self._data = [
+        default_data = [
             ("Staten Island", "Private room", "70"),
             ("Brooklyn", "Private room", "50"),
             ("Bronx", "Private room", "40"),
@@ -138,7 +2162,9 @@ class DataSet:
             ("Brooklyn", "Private room", "99"),
             ("Brooklyn", "Private room", "120")
         ]
-        self._initialize_sets()
+        self._load_rows((listing_id, location, property_type, int(price), ())
+                        for listing_id, (location, property_type, price)
+                        in enumerate(default_data))
 
     def get_labels(self, category: Categories):
         """Returns a list of the labels"""
@@ -148,63 +2174,101 @@ class DataSet:
         """Returns a list of the active labels"""
         return list(self._active_labels[category])
 
+    @instrumented
     def _table_statistics(self, row_category: Categories, label: str):
-        """Prints a table of the minimum, average, and maximum labels
-        that matches the category"""
+        """Returns the minimum, average, and maximum rent of a label of
+        the category from the maintained marginals"""
         if self._data is None:
             raise self.EmptyDatasetError
-        list_of_other_category = self.get_active_labels(Categories.
-                                                        LOCATION) \
-            if row_category == Categories.PROPERTY_TYPE \
-            else self.get_active_labels(Categories.PROPERTY_TYPE)
-
-        data = []
-        if row_category == Categories.PROPERTY_TYPE:
-            for category in list_of_other_category:
-                try:
-                    data.append(self._cross_table_statistics(category,
-                                                             label))
-                except self.NoMatchingItems:
-                    pass
-        else:
-            for category in list_of_other_category:
-                try:
-                    data.append(self._cross_table_statistics(label,
-                                                             category))
-                except self.NoMatchingItems:
-                    pass
-        minimum, average, maximum, _ = data[0]
-        for part_of_data in data:
-            mi, sub_average, ma, added_values = part_of_data
-            minimum = min(mi, minimum)
-            average += (sub_average * added_values)
-            maximum = max(ma, maximum)
-        return minimum, average / sum([length[3] for length in data]),\
-               maximum
-
-    def display_field_table(self, rows: Categories):
-        """Displays a table of the minimum, maximum, average for each
-        item in a category"""
-        list_of_rows = self.get_active_labels(rows)
-
-        table = "\t\t\t\t\tMinimum\t\t\tAverage\t\t\tMaximum\n"
-        for row in list_of_rows:
-            table += str(row) + ("\t" * (((20 - len(str(row))) // 4) +
-                                         (1 if len(str(row)) % 4 != 0
-                                          else 0)
-                                         ))
-            for value in self._table_statistics(rows, row):
-                if value is None:
-                    table += "N/A\t\t\t\t\t"
-                    continue
-                str_to_add = f"$ {value:.2f}"
-                table += str_to_add + ("\t" *
-                                       (((16 - len(str_to_add)) // 4) +
-                                       (1 if len(str_to_add) % 4 != 0
-                                        else 0)))
-            table += "\n"
-
-        print(table)
+        marginal = self._marginal_aggregates()[row_category].get(label)
+        if marginal is None or marginal.count == 0:
+            raise self.NoMatchingItems("Found no items matching your "
+                                       "search")
+        return marginal.minimums[0], marginal.total / marginal.count, \
+            marginal.maximums[-1]
+
+    def _marginal_aggregates(self):
+        """Returns the marginal of every label in each category, which
+        combines its cells with every active label of the other
+        category"""
+        if self._marginals is None:
+            marginals = {Categories.LOCATION: {},
+                         Categories.PROPERTY_TYPE: {}}
+            for (location, property_type), cell in \
+                    self._group_aggregates().items():
+                by_location = marginals[Categories.LOCATION].setdefault(
+                    location, _Marginal())
+                by_property_type = marginals[
+                    Categories.PROPERTY_TYPE].setdefault(property_type,
+                                                         _Marginal())
+                if property_type in self._active_labels[
+                        Categories.PROPERTY_TYPE]:
+                    by_location.add(cell)
+                if location in self._active_labels[Categories.LOCATION]:
+                    by_property_type.add(cell)
+            self._marginals = marginals
+        return self._marginals
+
+    def _update_marginals(self, category: Categories, descriptor: str,
+                          active: bool):
+        """Adds or removes the cells of a label that has just been
+        toggled to the marginals of the other category"""
+        if self._marginals is None:
+            return
+        aggregates = self._group_aggregates()
+        other_category = Categories.PROPERTY_TYPE \
+            if category == Categories.LOCATION else Categories.LOCATION
+        for label, marginal in self._marginals[other_category].items():
+            cell = aggregates.get((descriptor, label)
+                                  if category == Categories.LOCATION
+                                  else (label, descriptor))
+            if cell is None:
+                continue
+            if active:
+                marginal.add(cell)
+            else:
+                marginal.remove(cell)
+
+    @instrumented
+    def field_table(self, rows: Categories,
+                    stats=(Stats.MIN, Stats.AVG, Stats.MAX),
+                    approximate=False, active_labels=None):
+        """Returns a table of the minimum, maximum, average, or other
+        statistics for each active item in a category. A dictionary of
+        active labels may be given in place of the dataset's own"""
+        active_labels = active_labels or self._active_labels
+        return self._cached(("field_table", rows, tuple(stats),
+                             approximate),
+                            lambda: self._compute_field_table(
+                                rows, stats, approximate, active_labels),
+                            active_labels)
+
+    def _compute_field_table(self, rows: Categories, stats, approximate,
+                             active_labels):
+        """Builds the table returned by field_table"""
+        list_of_rows = list(active_labels[rows])
+        results = self.query().where(
+            active_labels[Categories.LOCATION],
+            active_labels[Categories.PROPERTY_TYPE]).group_by(rows).agg(
+            *stats, approximate=approximate).execute()
+        return ResultTable("field_table", list_of_rows,
+                           [titles[state] for state in stats],
+                           [list(results.get((row,), (None,) * len(stats)))
+                            for row in list_of_rows],
+                           counts=[column for column, state
+                                   in enumerate(stats)
+                                   if state in distinct_counts])
+
+    @instrumented
+    def display_field_table(self, rows: Categories,
+                            stats=(Stats.MIN, Stats.AVG, Stats.MAX),
+                            approximate=False, file=None):
+        """Displays a table of the minimum, maximum, average, or other
+        statistics for each item in a category in the home currency"""
+        write_text(convert_table(self.field_table(rows, stats,
+                                                  approximate),
+                                 home_currency or data_currency),
+                   file or sys.stdout)
 
     def toggle_active_label(self, category: Categories,
                             descriptor: str):
@@ -213,18 +2277,435 @@ class DataSet:
             raise KeyError
         if descriptor not in self._active_labels[category]:
             self._active_labels[category].add(descriptor)
+            self._update_marginals(category, descriptor, True)
         else:
             self._active_labels[category].remove(descriptor)
+            self._update_marginals(category, descriptor, False)
+
+    @instrumented
+    def load_file(self, path=None, workers=1, snapshot=False, columns=(),
+                  aggregate_cache=False):
+        """Reads and parses a file and loads it into dataset, one row at
+        a time, keeping the named extra columns for group_by. With more
+        than one worker the file is split into chunks that are parsed in
+        separate processes; this assumes no quoted field spans more than
+        one line. With snapshot set, a binary snapshot next to the file
+        is used instead of parsing when it is newer than the file, can be
+        read, and has the extra columns, and rebuilt when it does not.
+        With aggregate_cache set, the aggregates saved next to a file
+        with the same fingerprint are restored without reading any rows,
+        which are then only loaded once a query needs them. A directory
+        or glob is opened as partitions with open_partitions"""
+        path = path or filename
+        if os.path.isdir(path) or glob.has_magic(path):
+            self.open_partitions(path, columns)
+            return
+        aggregates_path = os.path.splitext(path)[0] + ".aggregates.json"
+        if aggregate_cache and self._restore_aggregates(path,
+                                                        aggregates_path,
+                                                        columns):
+            print(str(sum(cell[0] for cell in self._cells.values())) +
+                  " lines have been restored")
+            return
+        snapshot_path = os.path.splitext(path)[0] + ".snapshot"
+        if snapshot and os.path.exists(snapshot_path) and \
+                os.path.getmtime(snapshot_path) >= os.path.getmtime(path):
+            try:
+                self.load_snapshot(snapshot_path)
+            except ValueError:
+                snapshot_path = None
+            else:
+                if not set(columns) <= set(self._data.names):
+                    snapshot_path = None
+        else:
+            snapshot_path = None
+        if snapshot_path is None:
+            if workers > 1:
+                self._load_chunks(path, workers, columns)
+            else:
+                self._load_rows(report_progress(read_rows(path, columns)),
+                                columns)
+            if snapshot:
+                self.save_snapshot(os.path.splitext(path)[0] + ".snapshot")
+        if aggregate_cache:
+            self.save_aggregates(aggregates_path, path)
+        print(str(len(self._data)) + " lines have been loaded")
+
+    def save_aggregates(self, path, source):
+        """Saves the labels and the aggregates, sketches, and sample of
+        every cell to a JSON file, keyed by the fingerprint of the source
+        file"""
+        with _replacing(path) as file:
+            json.dump({"version": aggregates_version,
+                       "fingerprint": fingerprint(source),
+                       "locations":
+                           self._data.dictionary[Categories.LOCATION],
+                       "property_types":
+                           self._data.dictionary[Categories.PROPERTY_TYPE],
+                       "columns": {name: self._data.dictionary[name]
+                                   for name in self._data.names},
+                       "cells": _saved_cells(self._group_aggregates())},
+                      file)
+
+    def _restore_aggregates(self, source, path, columns=()):
+        """Replaces the dataset with the labels and aggregates saved for
+        a source file if they match its fingerprint and have the extra
+        columns, and returns whether they did. A file that cannot be
+        read counts as not matching, so that it is saved again"""
+        if not os.path.exists(path):
+            return False
+        try:
+            with open(path) as file:
+                saved = json.load(file)
+            if saved.get("version") != aggregates_version or \
+                    saved["fingerprint"] != fingerprint(source) or \
+                    not set(columns) <= set(saved["columns"]):
+                return False
+            data = _Columns(saved["columns"])
+            for column, labels in ((Categories.LOCATION,
+                                    saved["locations"]),
+                                   (Categories.PROPERTY_TYPE,
+                                    saved["property_types"]),
+                                   *saved["columns"].items()):
+                for label in labels:
+                    data.encode(column, label)
+            cells = _restored_cells(data, saved["cells"])
+        except (ValueError, KeyError, TypeError, AttributeError):
+            return False
+        self._data, self._cells = data, cells
+        self._initialize_sets()
+        self._summary_path = source
+        return True
+
+    def _require_rows(self, filters=None, price=None):
+        """Loads the rows behind restored aggregates or a SQLite store, or
+        the rows of the partitions that can match a dictionary from
+        columns to label sets and a (low, high) price range, when a query
+        needs them. Rows are loaded under the dataset's lock and only
+        added once they are complete, so threads may query the dataset
+        meanwhile. Raises EmptyDatasetError when nothing is loaded"""
+        with self._building:
+            if self._partitions is not None:
+                self._load_partitions(filters or {}, price)
+                return
+            if self._store is not None or self._summary_path is not None:
+                loaded = DataSet()
+                if self._store is not None:
+                    loaded._load_rows(self._store.rows(), self._store.names)
+                else:
+                    with contextlib.redirect_stdout(io.StringIO()):
+                        loaded.load_file(self._summary_path,
+                                         columns=self._data.names)
+                self._data, self._cells = loaded._data, loaded._cells
+                self._aggregates = None
+                self._store = self._summary_path = None
+            if not self._data:
+                raise self.EmptyDatasetError
+
+    @instrumented
+    def open_partitions(self, pattern, columns=()):
+        """Opens every csv file in a directory, or every csv or snapshot
+        file matching a glob, as one dataset without reading its rows.
+        The labels, row count, price range, and aggregates of each
+        partition are restored from its aggregate file, which is saved
+        the first time a partition is read, and only the partitions that
+        can match a query are read when it needs rows"""
+        paths = sorted(glob.glob(os.path.join(pattern, "*.csv"))
+                       if os.path.isdir(pattern) else glob.glob(pattern))
+        if not paths:
+            raise FileNotFoundError(f"No partitions match {pattern}")
+        data = _Columns(columns)
+        cells = {}
+        partitions = []
+        for path in paths:
+            partition = DataSet()
+            with contextlib.redirect_stdout(io.StringIO()):
+                if path.endswith(".snapshot"):
+                    partition.load_snapshot(path)
+                else:
+                    partition.load_file(path, columns=columns,
+                                        aggregate_cache=True)
+            mappings = {column: [data.encode(column, label)
+                                 for label in
+                                 partition._data.dictionary[column]]
+                        for column in data.dictionary}
+            partition_cells = list(partition._group_aggregates().values())
+            for (location, property_type), cell in \
+                    partition._cells.items():
+                _merge_cell(cells,
+                            (mappings[Categories.LOCATION][location],
+                             mappings[Categories.PROPERTY_TYPE][
+                                 property_type]), cell)
+            partitions.append({
+                "path": path,
+                "rows": sum(cell[0] for cell in partition_cells),
+                "labels": {column: frozenset(labels) for column, labels
+                           in partition._data.dictionary.items()},
+                "prices": (min(cell[1] for cell in partition_cells),
+                           max(cell[3] for cell in partition_cells))
+                if partition_cells else None,
+                "loaded": False})
+        self._data, self._cells = data, cells
+        self._initialize_sets()
+        self._partitions = partitions
+        print(f"{sum(partition['rows'] for partition in partitions)} lines "
+              f"in {len(partitions)} partitions have been opened")
+
+    def _load_partitions(self, filters, price=None):
+        """Reads the rows of every partition that has not been read yet
+        and whose labels and price range can match the filters. The rows
+        are added to a copy of the columns and partition list, which then
+        replace the dataset's own, so that a copy of the dataset sharing
+        them, such as an older version, is not changed"""
+        pending = [partition for partition in self._partitions
+                   if not partition["loaded"] and
+                   partition["prices"] is not None and
+                   all(not partition["labels"].get(column, labels)
+                       .isdisjoint(labels)
+                       for column, labels in filters.items()) and
+                   (price is None or
+                    price[0] <= partition["prices"][1] and
+                    partition["prices"][0] <= price[1])]
+        if not pending:
+            return
+        data = self._data.copy()
+        for partition in pending:
+            if partition["path"].endswith(".snapshot"):
+                data.extend(_Columns.open(partition["path"]))
+            else:
+                for row in read_rows(partition["path"], data.names):
+                    data.append(*row)
+            _count_rows(partition["rows"])
+        loaded = {partition["path"] for partition in pending}
+        self._data = data
+        self._partitions = [dict(partition, loaded=True)
+                            if partition["path"] in loaded else partition
+                            for partition in self._partitions]
+        self._indexes = None
+        self._price_index = None
+        self._listing_ids = None
+        self._cache.clear()
+
+    def partitions(self):
+        """Returns the path, row count, price range, and whether the rows
+        have been read of every partition"""
+        return [{key: partition[key]
+                 for key in ("path", "rows", "prices", "loaded")}
+                for partition in self._partitions or ()]
+
+    @instrumented
+    def load_sqlite(self, path=None, database=None, columns=()):
+        """Imports a csv file into a SQLite database, by default next to
+        it, unless the database already holds that file, and answers
+        queries from the database with SQL rather than keeping the rows
+        in memory. The rows are read back only when a query needs them
+        """
+        path = path or filename
+        store = SQLiteStore(database or
+                            os.path.splitext(path)[0] + ".sqlite")
+        if not store.matches(path, columns):
+            store.import_rows(report_progress(read_rows(path, columns)),
+                              columns, path)
+        data = _Columns(store.names)
+        for column in data.dictionary:
+            for label in store.labels(column):
+                data.encode(column, label)
+        self._data = data
+        self._cells = {
+            (data.code_of(Categories.LOCATION, location),
+             data.code_of(Categories.PROPERTY_TYPE, property_type)):
+                [*cell, None, None, None, None]
+            for (location, property_type), cell in store.aggregate(
+                (Categories.LOCATION, Categories.PROPERTY_TYPE)).items()}
+        self._initialize_sets()
+        self._store = store
+        print(str(sum(cell[0] for cell in self._cells.values())) +
+              " lines are in " + store.path)
+
+    def prepare(self):
+        """Builds the aggregates, marginals, and indexes that queries
+        would otherwise build the first time they need them. Rows kept in
+        SQLite, in partitions, or behind restored aggregates are left
+        where they are, to be read under the dataset's lock by the first
+        query that needs them"""
+        self._group_aggregates()
+        self._marginal_aggregates()
+        if self._store is None and self._partitions is None and \
+                self._summary_path is None:
+            self._indexes_for()
+            self._price_index_for()
+
+    def save_snapshot(self, path):
+        """Saves the loaded data and the aggregates, sketches, and sample
+        of every cell to a binary snapshot file"""
+        self._require_rows()
+        self._data.save(path, _saved_cells(self._group_aggregates()))
+
+    def load_snapshot(self, path):
+        """Replaces the dataset with the contents of a snapshot file,
+        which is memory mapped rather than parsed, and the cells saved in
+        it, so that statistics need not be computed from the rows. Raises
+        ValueError if the file is not a compatible snapshot"""
+        data = _Columns.open(path)
+        try:
+            cells = _restored_cells(data, data.saved_cells)
+        except (ValueError, KeyError, TypeError, AttributeError):
+            raise ValueError(f"{path} is not a compatible snapshot")
+        finally:
+            data.saved_cells = None
+        self._data, self._cells = data, cells
+        self._initialize_sets()
+
+    def _load_rows(self, rows, columns=()):
+        """Replaces the dataset with the given rows, updating the
+        aggregates as each row arrives"""
+        self._data, self._cells = _ingest(rows, columns)
+        _count_rows(len(self._data))
+        self._initialize_sets()
 
-    def load_file(self):
-        """Reads and parses a file and loads it into dataset"""
-        file = open(filename)
-        file_list = file.readlines()
-        headers = file_list[0]
-        self._data = [lst.split(",")[1:] for lst in file_list[1:]]
-        print(str(len(file_list[1:])) + " lines have been loaded")
+    def _load_chunks(self, path, workers, columns=()):
+        """Replaces the dataset with the rows of a file, parsing chunks
+        of it in a pool of worker processes and merging their columns
+        and aggregates in file order"""
+        indexes = _column_indexes(read_header(path), columns)
+        ranges = _chunk_offsets(path, max(workers,
+                                          os.path.getsize(path) //
+                                          chunk_size))
+        data = _Columns(columns)
+        cells = {}
+        with ProcessPoolExecutor(max_workers=workers) as executor:
+            for chunk, chunk_cells in executor.map(
+                    _load_chunk, *zip(*[(path, start, end, indexes,
+                                         columns)
+                                        for start, end in ranges])):
+                mappings = data.extend(chunk)
+                for (location, property_type), cell in \
+                        chunk_cells.items():
+                    _merge_cell(cells,
+                                (mappings[Categories.LOCATION][location],
+                                 mappings[Categories.PROPERTY_TYPE][
+                                     property_type]), cell)
+                print(f"{len(data)} lines loaded...")
+        self._data, self._cells = data, cells
+        _count_rows(len(self._data))
         self._initialize_sets()
 
+    @instrumented
+    def append_file(self, path):
+        """Reads a file of new listings and adds the ones whose id has
+        not been loaded yet, keeping the current filters"""
+        columns = self._data.names if self._data else ()
+        added = self._append(report_progress(read_rows(path, columns)))
+        print(str(added) + " new lines have been appended")
+
+    def append_rows(self, rows):
+        """Adds (listing id, location, property type, price) rows whose
+        id has not been loaded yet and returns how many were added. When
+        extra columns are loaded, each row ends with a tuple of their
+        values in the order of the loaded column names"""
+        return self._append((listing_id, location, property_type, price,
+                             tuple(extras[0]) if extras else ())
+                            for listing_id, location, property_type, price,
+                            *extras in rows)
+
+    def _append(self, rows):
+        """Adds new rows to the columns, label sets, aggregates, and any
+        indexes that have been built, in time proportional to the
+        number of rows, and returns how many were added. A row without
+        a value for every extra column raises ValueError, keeping the
+        rows before it"""
+        if self._summary_path is not None or \
+                self._partitions is not None or self._store is not None:
+            self._require_rows()
+        if self._data is None:
+            self._data, self._cells = _Columns(), {}
+        self._group_aggregates()
+        self._data.make_appendable()
+        if self._listing_ids is None:
+            self._listing_ids = set(self._data.ids)
+        host = self._data.names.index(host_column) \
+            if host_column in self._data.names else None
+        changed = {}
+        priced = {}
+        added = 0
+        try:
+            for listing_id, location, property_type, rent, extras in rows:
+                if listing_id in self._listing_ids:
+                    continue
+                row_id = len(self._data)
+                key = self._data.append(listing_id, location,
+                                        property_type, rent, extras)
+                self._listing_ids.add(listing_id)
+                if key not in changed:
+                    cell = self._cells.get(key)
+                    changed[key] = None if cell is None else cell[:4]
+                _add_to_cell(self._cells, key, rent, listing_id,
+                             None if host is None else extras[host])
+                for category, label in ((Categories.LOCATION, location),
+                                        (Categories.PROPERTY_TYPE,
+                                         property_type)):
+                    if label not in self._labels[category]:
+                        self._labels[category].add(label)
+                        self._active_labels[category].add(label)
+                    if self._indexes is not None:
+                        self._indexes[category].setdefault(
+                            label, array("I")).append(row_id)
+                if self._price_index is not None:
+                    priced.setdefault((location, property_type),
+                                      []).append((rent, row_id))
+                added += 1
+        finally:
+            if priced:
+                self._merge_price_rows(priced)
+            _count_rows(added)
+            self._aggregates = None
+            self._cache.clear()
+            if self._marginals is not None:
+                self._update_changed_marginals(changed)
+        return added
+
+    def _merge_price_rows(self, priced):
+        """Merges the (rent, row id) pairs appended to each cell into its
+        sorted rents and row ids, sorting them and copying each cell
+        once however many rows it gains. Rents equal to existing ones go
+        after them, in the order they were appended"""
+        for key, rows in priced.items():
+            rows.sort(key=lambda row: row[0])
+            prices, ids = self._price_index.get(key,
+                                                (array("i"), array("I")))
+            merged_prices, merged_ids = array("i"), array("I")
+            start = 0
+            for rent, row_id in rows:
+                position = bisect.bisect_right(prices, rent, start)
+                merged_prices += prices[start:position]
+                merged_ids += ids[start:position]
+                merged_prices.append(rent)
+                merged_ids.append(row_id)
+                start = position
+            merged_prices += prices[start:]
+            merged_ids += ids[start:]
+            self._price_index[key] = (merged_prices, merged_ids)
+
+    def _update_changed_marginals(self, changed):
+        """Replaces the old values of the changed cells with their new
+        ones in the marginals"""
+        locations = self._data.dictionary[Categories.LOCATION]
+        property_types = self._data.dictionary[Categories.PROPERTY_TYPE]
+        for key, old in changed.items():
+            location, property_type = locations[key[0]], \
+                property_types[key[1]]
+            for category, label, other_category, other in (
+                    (Categories.LOCATION, location,
+                     Categories.PROPERTY_TYPE, property_type),
+                    (Categories.PROPERTY_TYPE, property_type,
+                     Categories.LOCATION, location)):
+                marginal = self._marginals[category].setdefault(
+                    label, _Marginal())
+                if other in self._active_labels[other_category]:
+                    if old is not None:
+                        marginal.remove(old)
+                    marginal.add(self._cells[key])
+
     class EmptyDatasetError(Exception):
         """An exception that will be raised when no dataset is loaded"""
         pass
@@ -236,6 +2717,81 @@ class DataSet:
         pass
 
 
+class VersionedDataSet:
+    """Publishes numbered versions of a dataset that are never changed
+    once published. Readers pin the current version and query it for as
+    long as they need while the next one is built, which then replaces
+    it with a single assignment, so reading takes no locks
+    """
+
+    def __init__(self, load=None):
+        """Creates an empty set of versions, where load is called with a
+        new DataSet to fill it, by default with load_file"""
+        self.load = load or DataSet.load_file
+        self._current = (0, None)
+        self._writing = threading.Lock()
+        self._starting = threading.Lock()
+        self._reloading = None
+
+    def pin(self):
+        """Returns the current version number and its dataset, which
+        must only be queried and not changed"""
+        version, dataset = self._current
+        if dataset is None:
+            raise DataSet.EmptyDatasetError
+        return version, dataset
+
+    def _publish(self, dataset: DataSet):
+        """Prepares a dataset and makes it the current version"""
+        dataset.prepare()
+        self._current = (self._current[0] + 1, dataset)
+        return self._current[0]
+
+    def reload(self):
+        """Loads a new version, keeping the labels that are turned off in
+        the current one off, and returns its number once it is published.
+        Readers keep using the current version until then"""
+        with self._writing:
+            dataset = DataSet()
+            self.load(dataset)
+            current = self._current[1]
+            if current is not None:
+                dataset.header = current.header
+                for category in Categories:
+                    dataset._active_labels[category] -= \
+                        current._labels[category] - \
+                        current._active_labels[category]
+            return self._publish(dataset)
+
+    def reload_in_background(self):
+        """Starts a reload on a new thread and returns the thread. While
+        a reload started this way is still running, no other is started
+        and its thread is returned instead"""
+        with self._starting:
+            thread = self._reloading
+            if thread is None or not thread.is_alive():
+                thread = self._reloading = threading.Thread(
+                    target=self.reload, daemon=True)
+                thread.start()
+            return thread
+
+    def toggle_active_label(self, category: Categories, descriptor: str):
+        """Publishes a version with a label turned on or off that shares
+        the rows, aggregates, and indexes of the current one. Rows that
+        either version loads later are added to its own copy of them"""
+        with self._writing:
+            current = self.pin()[1]
+            dataset = copy.copy(current)
+            dataset._building = threading.RLock()
+            dataset._active_labels = {
+                category: set(labels)
+                for category, labels in current._active_labels.items()}
+            dataset._marginals = None
+            dataset._cache = OrderedDict()
+            dataset.toggle_active_label(category, descriptor)
+            return self._publish(dataset)
+
+
 def manage_filters(dataset: DataSet, category: Categories):
     """Allows the user to change active labels"""
     while True:
@@ -325,6 +2881,322 @@ def test_cross_table_stats(dataset, borough, room_type,
         return "Fail"
 
 
+def _table_values(table: ResultTable):
+    """Returns the cells of a table keyed by their row and column labels,
+    which do not depend on the order of the labels"""
+    return {(row_label, column_label): value
+            for row_label, row in zip(table.row_labels, table.cells)
+            for column_label, value in zip(table.column_labels, row)}
+
+
+def test_parallel_load(path, workers=2):
+    """ Checks whether loading a file in chunks on several processes
+    gives the same rows and tables as loading it on one, and returns
+    pass or fail
+    """
+    serial, parallel = DataSet(), DataSet()
+    with contextlib.redirect_stdout(io.StringIO()):
+        serial.load_file(path)
+        parallel.load_file(path, workers)
+    same_rows = all(list(getattr(serial._data, column)) ==
+                    list(getattr(parallel._data, column))
+                    for column in ("ids", "locations", "property_types",
+                                   "prices"))
+    same_tables = all(_table_values(serial.cross_table(state)) ==
+                      _table_values(parallel.cross_table(state))
+                      for state in Stats if state != Stats.DISTINCT_HOSTS)
+    return "Pass" if same_rows and same_tables else "Fail"
+
+
+def _active_rents(dataset, category: Categories):
+    """Returns the rents of the rows whose labels are all active, listed
+    by their label of the category"""
+    rents = {}
+    data = dataset._data
+    for location, property_type, price in zip(
+            data.locations, data.property_types, data.prices):
+        labels = {Categories.LOCATION:
+                  data.dictionary[Categories.LOCATION][location],
+                  Categories.PROPERTY_TYPE:
+                  data.dictionary[Categories.PROPERTY_TYPE][property_type]}
+        if all(labels[other] in dataset.get_active_labels(other)
+               for other in Categories):
+            rents.setdefault(labels[category], []).append(price)
+    return rents
+
+
+def test_marginals_after_toggles(path):
+    """ Checks whether the field tables read from the maintained
+    marginals match the rows of the active labels after labels are
+    toggled off and on, and returns pass or fail
+    """
+    dataset = DataSet()
+    with contextlib.redirect_stdout(io.StringIO()):
+        dataset.load_file(path)
+    location = sorted(dataset.get_labels(Categories.LOCATION))[0]
+    property_type = sorted(dataset.get_labels(Categories.PROPERTY_TYPE))[0]
+    toggles = [(None, None), (Categories.LOCATION, location),
+               (Categories.PROPERTY_TYPE, property_type),
+               (Categories.LOCATION, location)]
+    for category, label in toggles:
+        if category is not None:
+            dataset.toggle_active_label(category, label)
+        for rows in Categories:
+            rents = _active_rents(dataset, rows)
+            table = dataset.field_table(rows)
+            for row_label, (minimum, average, maximum) in zip(
+                    table.row_labels, table.cells):
+                expected = rents.get(row_label)
+                if expected is None:
+                    if minimum is not None:
+                        return "Fail"
+                elif (minimum, maximum) != (min(expected), max(expected)) \
+                        or not math.isclose(average, sum(expected) /
+                                            len(expected)):
+                    return "Fail"
+    return "Pass"
+
+
+def test_exact_percentiles(path):
+    """ Checks whether the exact percentiles of the cross and field
+    tables, with and without a price index, are the nearest ranks of the
+    sorted rents, and returns pass or fail
+    """
+    dataset = DataSet()
+    dataset.cache_size = 0
+    with contextlib.redirect_stdout(io.StringIO()):
+        dataset.load_file(path)
+    by_cell = {}
+    data = dataset._data
+    for location, property_type, price in zip(
+            data.locations, data.property_types, data.prices):
+        by_cell.setdefault(
+            (data.dictionary[Categories.LOCATION][location],
+             data.dictionary[Categories.PROPERTY_TYPE][property_type]),
+            []).append(price)
+
+    def nearest_rank(rents, quantile):
+        rents = sorted(rents)
+        return rents[max(math.ceil(quantile * len(rents)), 1) - 1]
+
+    expected = {location: [nearest_rank(rents, quantile)
+                           for quantile in quantiles.values()]
+                for location, rents in _active_rents(
+                    dataset, Categories.LOCATION).items()}
+    for indexed in (False, True):
+        if indexed:
+            dataset.build_price_index()
+        table = dataset.field_table(Categories.LOCATION, list(quantiles))
+        if dict(zip(table.row_labels, table.cells)) != expected:
+            return "Fail"
+        for state, quantile in quantiles.items():
+            values = _table_values(dataset.cross_table(state))
+            if any(values[key] != nearest_rank(rents, quantile)
+                   for key, rents in by_cell.items()):
+                return "Fail"
+    return "Pass"
+
+
+def test_append_deduplication(dataset):
+    """ Checks whether appending rows skips the ids already loaded or
+    repeated in the same batch, updates the tables with the rest, and
+    returns pass or fail
+    """
+    dataset.build_price_index()
+    rows = [(0, "Brooklyn", "Private room", 999),
+            (100, "Bronx", "Entire home/apt", 80),
+            (100, "Bronx", "Entire home/apt", 999)]
+    if dataset.append_rows(rows) != 1 or dataset.append_rows(rows) != 0:
+        return "Fail"
+    maximums = _table_values(dataset.cross_table(Stats.MAX))
+    medians = _table_values(dataset.cross_table(Stats.MEDIAN))
+    if len(dataset._data) != 19 or \
+            maximums[("Brooklyn", "Private room")] != 120 or \
+            maximums[("Bronx", "Entire home/apt")] != 80 or \
+            medians[("Bronx", "Entire home/apt")] != 80:
+        return "Fail"
+    return "Pass"
+
+
+def test_sqlite_tables(path, database):
+    """ Checks whether the cross and field tables answered with SQL from
+    a SQLite database match those of the rows loaded in memory, before
+    and after a label is toggled, and returns pass, fail, or skipped
+    when sqlite3 is not available
+    """
+    if sqlite3 is None:
+        return "Skipped"
+    in_memory, in_sqlite = DataSet(), DataSet()
+    with contextlib.redirect_stdout(io.StringIO()):
+        in_memory.load_file(path)
+        in_sqlite.load_sqlite(path, database)
+    stats = [state for state in Stats if state != Stats.DISTINCT_HOSTS]
+    location = sorted(in_memory.get_labels(Categories.LOCATION))[0]
+    for toggled in (False, True):
+        if toggled:
+            in_memory.toggle_active_label(Categories.LOCATION, location)
+            in_sqlite.toggle_active_label(Categories.LOCATION, location)
+        if any(_table_values(in_memory.cross_table(state)) !=
+               _table_values(in_sqlite.cross_table(state))
+               for state in stats) or \
+                any(_table_values(in_memory.field_table(rows, stats)) !=
+                    _table_values(in_sqlite.field_table(rows, stats))
+                    for rows in Categories):
+            return "Fail"
+    return "Pass"
+
+
+def test_partition_pruning(path, directory):
+    """ Checks whether a file split into one partition per location
+    gives the same tables as the single file, reads only the partitions
+    a query can match, and keeps a pinned version's answers when a newer
+    version reads more partitions, and returns pass or fail
+    """
+    single = DataSet()
+    with contextlib.redirect_stdout(io.StringIO()):
+        single.load_file(path)
+    with open(path, newline="", encoding="utf-8") as file:
+        header, *rows = csv.reader(file)
+    for location in single.get_labels(Categories.LOCATION):
+        with open(os.path.join(directory, location + ".csv"), "w",
+                  newline="", encoding="utf-8") as file:
+            csv.writer(file).writerows([header] + [row for row in rows
+                                                   if row[1] == location])
+    first, second = sorted(single.get_labels(Categories.LOCATION))[:2]
+    versions = VersionedDataSet(
+        lambda dataset: dataset.load_file(directory))
+    with contextlib.redirect_stdout(io.StringIO()):
+        versions.reload()
+    _, pinned = versions.pin()
+
+    def loaded():
+        return {os.path.basename(partition["path"])[:-4]
+                for partition in pinned.partitions()
+                if partition["loaded"]}
+
+    def median(dataset, location):
+        return dataset.query().where(location).agg(Stats.MEDIAN).execute()
+
+    if _table_values(pinned.cross_table(Stats.AVG)) != \
+            _table_values(single.cross_table(Stats.AVG)) or loaded() or \
+            median(pinned, first) != median(single, first) or \
+            loaded() != {first}:
+        return "Fail"
+    versions.toggle_active_label(Categories.PROPERTY_TYPE, sorted(
+        single.get_labels(Categories.PROPERTY_TYPE))[0])
+    if median(versions.pin()[1], second) != median(single, second) or \
+            loaded() != {first} or \
+            median(pinned, second) != median(single, second) or \
+            [price for _, _, price in pinned.top_listings(
+                location=second)] != \
+            [price for _, _, price in single.top_listings(
+                location=second)] or \
+            pinned.count_in_range(0, 100) != single.count_in_range(0, 100):
+        return "Fail"
+    if _table_values(pinned.cross_table(Stats.MEDIAN)) != \
+            _table_values(single.cross_table(Stats.MEDIAN)) or \
+            len(pinned._data) != len(single._data):
+        return "Fail"
+    return "Pass"
+
+
+def test_distinct_listings(path, workers=2):
+    """ Checks whether the distinct listings of every cell are within
+    three standard errors of the exact count, and whether merged
+    sketches, from a parallel load or across the cells of a field table
+    row, equal the sketch of all their listings, and returns pass or fail
+    """
+    serial, parallel = DataSet(), DataSet()
+    with contextlib.redirect_stdout(io.StringIO()):
+        serial.load_file(path)
+        parallel.load_file(path, workers)
+    data = serial._data
+    listings = {}
+    for location, property_type, listing_id in zip(
+            data.locations, data.property_types, data.ids):
+        listings.setdefault(
+            (data.dictionary[Categories.LOCATION][location],
+             data.dictionary[Categories.PROPERTY_TYPE][property_type]),
+            set()).add(listing_id)
+    estimates = _table_values(serial.cross_table(Stats.DISTINCT_LISTINGS))
+    if any(abs(estimates[key] - len(ids)) >
+           3 * HyperLogLog.relative_error() * len(ids)
+           for key, ids in listings.items()):
+        return "Fail"
+    if any(cell[6].registers !=
+           parallel._group_aggregates()[key][6].registers
+           for key, cell in serial._group_aggregates().items()):
+        return "Fail"
+    table = serial.field_table(Categories.LOCATION,
+                               [Stats.DISTINCT_LISTINGS])
+    for location, (estimate,) in zip(table.row_labels, table.cells):
+        union = HyperLogLog()
+        for (row_location, _), ids in listings.items():
+            if row_location == location:
+                for listing_id in ids:
+                    union.update(listing_id)
+        if estimate != union.count():
+            return "Fail"
+    return "Pass"
+
+
+def test_aggregate_cache(path, directory):
+    """ Checks whether aggregates restored from the file saved next to a
+    csv file give the same tables as reading it, keep the filters when a
+    query reads the rows, and are not used once the file changes or
+    when they cannot be read, and returns pass or fail
+    """
+    cached = os.path.join(directory, "cached.csv")
+    with open(path, encoding="utf-8") as source, \
+            open(cached, "w", encoding="utf-8") as file:
+        file.write(source.read())
+    full, saved, restored = DataSet(), DataSet(), DataSet()
+    with contextlib.redirect_stdout(io.StringIO()):
+        full.load_file(cached)
+        saved.load_file(cached, aggregate_cache=True)
+        restored.load_file(cached, aggregate_cache=True)
+    if restored._summary_path is None or restored._data:
+        return "Fail"
+    if any(_table_values(full.cross_table(state)) !=
+           _table_values(restored.cross_table(state))
+           for state in (Stats.MIN, Stats.AVG, Stats.MAX,
+                         Stats.DISTINCT_LISTINGS)) or \
+            any(_table_values(full.field_table(rows)) !=
+                _table_values(restored.field_table(rows))
+                for rows in Categories) or \
+            _table_values(saved.cross_table(Stats.MEDIAN, True)) != \
+            _table_values(restored.cross_table(Stats.MEDIAN, True)):
+        return "Fail"
+    location = sorted(full.get_labels(Categories.LOCATION))[0]
+    full.toggle_active_label(Categories.LOCATION, location)
+    restored.toggle_active_label(Categories.LOCATION, location)
+    if _table_values(full.cross_table(Stats.MEDIAN)) != \
+            _table_values(restored.cross_table(Stats.MEDIAN)) or \
+            restored._summary_path is not None or \
+            location in restored.get_active_labels(Categories.LOCATION):
+        return "Fail"
+    with open(cached, "a", encoding="utf-8") as file:
+        file.write(f"{len(full._data)},{location},Changed,100\n")
+    changed = DataSet()
+    with contextlib.redirect_stdout(io.StringIO()):
+        changed.load_file(cached, aggregate_cache=True)
+    if changed._summary_path is not None or \
+            len(changed._data) != len(full._data) + 1:
+        return "Fail"
+    with open(os.path.splitext(cached)[0] + ".aggregates.json",
+              "w") as file:
+        file.write("{")
+    corrupt, again = DataSet(), DataSet()
+    with contextlib.redirect_stdout(io.StringIO()):
+        corrupt.load_file(cached, aggregate_cache=True)
+        again.load_file(cached, aggregate_cache=True)
+    if corrupt._summary_path is not None or \
+            len(corrupt._data) != len(full._data) + 1 or \
+            again._summary_path is None:
+        return "Fail"
+    return "Pass"
+
+
 def unit_test():
     """ Tests the cross table statistics and load data methods in
     Class DataSet
@@ -348,6 +3220,458 @@ def unit_test():
           test_cross_table_stats(my_set, "Queens", "Entire home / apt"))
     print("One Matching Row Returns Correct Tuple: " +
           test_cross_table_stats(my_set, "Brooklyn", "Private room"))
+    print("Testing append_rows")
+    print("Appending Loaded Ids Adds No Rows: " +
+          test_append_deduplication(my_set))
+    with tempfile.TemporaryDirectory() as directory:
+        path = os.path.join(directory, "listings.csv")
+        generate_listings(path, 20000)
+        print("Testing load_file")
+        print("Parallel Load Matches Serial Load: " +
+              test_parallel_load(path))
+        print("Testing field_table")
+        print("Marginals Match Active Rows After Toggles: " +
+              test_marginals_after_toggles(path))
+        print("Exact Percentiles Match Sorted Rents: " +
+              test_exact_percentiles(path))
+        print("Testing load_sqlite")
+        print("SQLite Tables Match In-Memory Tables: " +
+              test_sqlite_tables(path, os.path.join(directory,
+                                                    "listings.sqlite")))
+        print("Testing aggregate_cache")
+        print("Restored Aggregates Match A Full Load: " +
+              test_aggregate_cache(path, directory))
+        print("Testing DISTINCT_LISTINGS")
+        print("Distinct Listings Are Within The Sketch Error: " +
+              test_distinct_listings(path))
+        print("Testing open_partitions")
+        partitions = os.path.join(directory, "partitions")
+        os.mkdir(partitions)
+        print("Partitions Are Read Only When A Query Can Match Them: " +
+              test_partition_pruning(path, partitions))
+
+
+def generate_listings(path, rows, locations=5, property_types=3, seed=0):
+    """Writes a csv file of random listings shaped like AB_NYC_2019.csv
+    with the given number of location and property type labels"""
+    generator = random.Random(seed)
+    location_labels = [f"Location {i + 1}" for i in range(locations)]
+    property_type_labels = [f"Property Type {i + 1}"
+                            for i in range(property_types)]
+    with open(path, "w", newline="", encoding="utf-8") as file:
+        writer = csv.writer(file)
+        writer.writerow(["id", "neighbourhood_group", "room_type",
+                         "price"])
+        for listing_id in range(rows):
+            writer.writerow([listing_id,
+                             generator.choice(location_labels),
+                             generator.choice(property_type_labels),
+                             int(generator.lognormvariate(4.7, 0.7))])
+
+
+def _peak_rss():
+    """Returns the peak resident set size of the process in kilobytes,
+    or None where it cannot be measured"""
+    if resource is None:
+        return None
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return peak // 1024 if sys.platform == "darwin" else peak
+
+
+def _time_operation(results, rows, operation, function, *args,
+                    backend="memory"):
+    """Runs a function with its output discarded and records how long
+    it took and the peak memory use of the process so far"""
+    start = time.perf_counter()
+    with contextlib.redirect_stdout(io.StringIO()):
+        function(*args)
+    results.append({"rows": rows, "backend": backend,
+                    "operation": operation,
+                    "seconds": time.perf_counter() - start,
+                    "peak_rss_kb": _peak_rss()})
+
+
+def _benchmark_dataset(path, rows, backend):
+    """Times loading a generated file into one backend and rendering its
+    tables with the result cache turned off, and returns the results.
+    Runs in a process of its own, so that the peak memory recorded is
+    that of this dataset alone"""
+    results = []
+    dataset = DataSet()
+    dataset.cache_size = 0
+    if backend == "memory":
+        _time_operation(results, rows, "load_file", dataset.load_file,
+                        path)
+    else:
+        _time_operation(results, rows, "load_sqlite", dataset.load_sqlite,
+                        path, backend=backend)
+    for state in Stats:
+        if state == Stats.DISTINCT_HOSTS:
+            continue  # the generated listings have no hosts
+        _time_operation(results, rows, f"display_cross_tables:{state.name}",
+                        dataset.display_cross_tables, state,
+                        backend=backend)
+    for category in Categories:
+        _time_operation(results, rows,
+                        f"display_field_table:{category.name}",
+                        dataset.display_field_table, category,
+                        backend=backend)
+    label = dataset.get_labels(Categories.LOCATION)[0]
+    for _ in range(2):
+        _time_operation(results, rows, "toggle_active_label",
+                        dataset.toggle_active_label, Categories.LOCATION,
+                        label, backend=backend)
+        _time_operation(results, rows, "display_field_table:PROPERTY_TYPE",
+                        dataset.display_field_table,
+                        Categories.PROPERTY_TYPE, backend=backend)
+    return results
+
+
+def benchmark(sizes=(50000, 1000000, 10000000), locations=5,
+              property_types=3, output=None):
+    """Times loading, the cross tables, the field tables, and toggling a
+    filter on generated datasets of each size, in memory and in SQLite
+    when it is available, each in a fresh process, and writes the
+    results as JSON to output or to the screen"""
+    results = []
+    backends = ("memory", "sqlite") if sqlite3 is not None else ("memory",)
+    with tempfile.TemporaryDirectory() as directory:
+        for rows in sizes:
+            path = os.path.join(directory, f"listings_{rows}.csv")
+            generate_listings(path, rows, locations, property_types)
+            for backend in backends:
+                with ProcessPoolExecutor(max_workers=1) as executor:
+                    results.extend(executor.submit(
+                        _benchmark_dataset, path, rows, backend).result())
+    report = json.dumps({"python": sys.version.split()[0],
+                         "locations": locations,
+                         "property_types": property_types,
+                         "results": results}, indent=2)
+    if output is None:
+        print(report)
+    else:
+        with open(output, "w") as file:
+            file.write(report)
+
+
+def parse_query(text):
+    """Parses a query written either as a JSON object or as
+    cross[:STAT], field[:CATEGORY[:STAT,STAT...]], or
+    group:COLUMN[,COLUMN...] and returns it as a dictionary"""
+    text = text.strip()
+    if text.startswith("{"):
+        return json.loads(text)
+    view, *parts = text.split(":")
+    if view == "cross":
+        return {"view": "cross", "stat": parts[0] if parts else "AVG"}
+    if view == "field":
+        query = {"view": "field",
+                 "category": parts[0] if parts else "LOCATION"}
+        if len(parts) > 1:
+            query["stats"] = parts[1].split(",")
+        return query
+    if view == "group" and parts:
+        return {"view": "group", "columns": parts[0].split(",")}
+    raise ValueError(f"Unknown query: {text}")
+
+
+def _query_labels(dataset: DataSet, query):
+    """Returns the active labels a query asks for, or None to use the
+    dataset's own"""
+    if not query.get("locations") and not query.get("property_types"):
+        return None
+    active_labels = {}
+    for category, key in ((Categories.LOCATION, "locations"),
+                          (Categories.PROPERTY_TYPE, "property_types")):
+        labels = query.get(key) or dataset.get_active_labels(category)
+        for label in labels:
+            if label not in dataset.get_labels(category):
+                raise KeyError(label)
+        active_labels[category] = set(labels)
+    return active_labels
+
+
+def run_query(dataset: DataSet, query):
+    """Answers a query dictionary against a loaded dataset and returns
+    the table in the query's currency"""
+    approximate = bool(query.get("approximate"))
+    active_labels = _query_labels(dataset, query)
+    if query.get("view") == "group":
+        groups = dataset.group_by(*query["columns"])
+        keys = sorted(groups)
+        table = ResultTable("group_by", [" / ".join(key) for key in keys],
+                            [titles[Stats.MIN], titles[Stats.AVG],
+                             titles[Stats.MAX]],
+                            [list(groups[key][:3]) for key in keys])
+    elif query.get("view", "cross") == "cross" and query.get("sampled"):
+        table = dataset.estimate_cross_table(
+            Stats[query.get("stat", "AVG")], query.get("confidence", 0.95),
+            query.get("max_error"), query.get("time_budget"),
+            active_labels)
+    elif query.get("view", "cross") == "cross":
+        table = dataset.cross_table(Stats[query.get("stat", "AVG")],
+                                    approximate, active_labels)
+    else:
+        stats = tuple(Stats[state] for state in
+                      query.get("stats", ("MIN", "AVG", "MAX")))
+        table = dataset.field_table(Categories[query.get("category",
+                                                         "LOCATION")],
+                                    stats, approximate, active_labels)
+    return convert_table(table, query.get("currency") or data_currency)
+
+
+def answer_query(dataset: DataSet, query, file):
+    """Runs a query and writes the table to a file in the query's
+    format. Errors are written as a JSON object instead"""
+    try:
+        formatters[query.get("format", "text")](run_query(dataset, query),
+                                                file)
+    except (DataSet.EmptyDatasetError, DataSet.NoMatchingItems, KeyError,
+            TypeError, ValueError) as error:
+        _write_error(error, file)
+
+
+def _write_error(error, file):
+    """Writes an error to a file as a JSON object"""
+    json.dump({"error": repr(error)}, file)
+    file.write("\n")
+
+
+def load_arguments(dataset: DataSet, arguments, progress=None):
+    """Loads the data named on the command line the way it asks for,
+    printing its progress to the progress file if one is given"""
+    with contextlib.redirect_stdout(progress or sys.stdout):
+        if arguments.sqlite:
+            dataset.load_sqlite(arguments.data, columns=arguments.columns)
+        else:
+            dataset.load_file(arguments.data, arguments.workers,
+                              arguments.snapshot, arguments.columns,
+                              arguments.aggregate_cache)
+
+
+def batch(arguments):
+    """Loads the dataset once and answers every query given on the
+    command line or in a query file, then any queries piped in on
+    standard input when running as a worker"""
+    dataset = DataSet()
+    with contextlib.redirect_stdout(sys.stderr):
+        load_arguments(dataset, arguments)
+        for path in arguments.append:
+            dataset.append_file(path)
+    defaults = {"format": arguments.format,
+                "currency": arguments.currency,
+                "approximate": arguments.approximate,
+                "sampled": arguments.sampled,
+                "confidence": arguments.confidence,
+                "max_error": arguments.max_error,
+                "time_budget": arguments.time_budget,
+                "locations": arguments.location,
+                "property_types": arguments.property_type}
+    texts = list(arguments.query)
+    if arguments.query_file:
+        with open(arguments.query_file) as file:
+            texts.extend(line for line in file if line.strip())
+    for text in texts:
+        answer_query(dataset, {**defaults, **parse_query(text)},
+                     sys.stdout)
+    if arguments.stdin:
+        for line in sys.stdin:
+            if not line.strip():
+                continue
+            try:
+                answer_query(dataset, {**defaults, **parse_query(line)},
+                             sys.stdout)
+            except ValueError as error:
+                _write_error(error, sys.stdout)
+            sys.stdout.flush()
+
+
+def answer_request(dataset: DataSet, request):
+    """Answers a server request and returns the response as a
+    dictionary. A request is a query, or has the view "stats" to ask
+    for the statistics of one location and/or property type"""
+    try:
+        if request.get("view") == "stats":
+            minimum, average, maximum, count = dataset.find_statistics(
+                request.get("location"), request.get("property_type"))
+            rate = conversion_matrix()[data_currency][
+                request.get("currency") or data_currency]
+            return {"statistics": {"min": minimum * rate,
+                                   "avg": average * rate,
+                                   "max": maximum * rate,
+                                   "count": count}}
+        return {"table": run_query(dataset, request).to_dict()}
+    except (DataSet.EmptyDatasetError, DataSet.NoMatchingItems, KeyError,
+            TypeError, ValueError) as error:
+        return {"error": repr(error)}
+
+
+async def serve(versions: VersionedDataSet, host="127.0.0.1", port=8765,
+                threads=4):
+    """Answers requests sent as one JSON object per line by any number
+    of clients until cancelled. Every request carries its own filters
+    and is answered from the version that was current when it arrived,
+    on one of several worker threads so the event loop keeps accepting
+    and reading while tables are computed. A request with the view
+    "reload" starts loading a new version in the background, unless one
+    is already loading, which then answers it too"""
+    loop = asyncio.get_running_loop()
+    executor = ThreadPoolExecutor(max_workers=threads)
+
+    async def respond(line):
+        """Returns the response to one request line, which describes the
+        error instead when the request cannot be answered"""
+        version = None
+        try:
+            request = json.loads(line)
+            if not isinstance(request, dict):
+                return {"error": "A request must be a JSON object"}
+            version, dataset = versions.pin()
+            if request.get("view") == "reload":
+                versions.reload_in_background()
+                response = {"reloading": True}
+            else:
+                response = await loop.run_in_executor(
+                    executor, answer_request, dataset, request)
+        except Exception as error:
+            response = {"error": repr(error)}
+        if version is not None:
+            response["version"] = version
+        return response
+
+    async def handle(reader, writer):
+        """Answers the requests of one client until it disconnects or
+        sends a line too long to read"""
+        try:
+            while line := await reader.readline():
+                writer.write(json.dumps(await respond(line)).encode() +
+                             b"\n")
+                await writer.drain()
+        except (ConnectionError, ValueError):
+            pass
+        finally:
+            writer.close()
+
+    server = await asyncio.start_server(handle, host, port)
+    print(f"Serving on {host}:{port}", file=sys.stderr)
+    try:
+        async with server:
+            await server.serve_forever()
+    finally:
+        executor.shutdown(wait=False)
+
+
+async def load_test(host="127.0.0.1", port=8765, requests=1000, clients=10,
+                    queries=None):
+    """Sends requests to a running server from several concurrent
+    clients and returns the throughput and latency percentiles"""
+    queries = queries or [{"view": "cross", "stat": state.name}
+                          for state in (Stats.MIN, Stats.AVG, Stats.MAX)] + \
+        [{"view": "field", "category": category.name}
+         for category in Categories]
+    latencies = []
+
+    async def client(count, offset):
+        """Sends count requests over one connection"""
+        reader, writer = await asyncio.open_connection(host, port)
+        for i in range(count):
+            request = json.dumps(queries[(offset + i) % len(queries)])
+            start = time.perf_counter()
+            writer.write(request.encode() + b"\n")
+            await writer.drain()
+            await reader.readline()
+            latencies.append(time.perf_counter() - start)
+        writer.close()
+        await writer.wait_closed()
+
+    start = time.perf_counter()
+    await asyncio.gather(*(client(requests // clients +
+                                  (1 if i < requests % clients else 0), i)
+                           for i in range(clients)))
+    seconds = time.perf_counter() - start
+    latencies.sort()
+    return {"requests": len(latencies), "clients": clients,
+            "seconds": seconds,
+            "requests_per_second": len(latencies) / seconds,
+            "p50_ms": _select(latencies, 0.5) * 1000,
+            "p99_ms": _select(latencies, 0.99) * 1000,
+            "max_ms": latencies[-1] * 1000}
+
+
+def parse_arguments(arguments=None):
+    """Returns the parsed command line arguments"""
+    parser = argparse.ArgumentParser(
+        description="Foothill's database project. Runs the interactive "
+                    "menu unless --batch, --serve, --load-test, or "
+                    "--benchmark is given")
+    parser.add_argument("--batch", action="store_true",
+                        help="answer queries without any prompts")
+    parser.add_argument("--data", default=filename,
+                        help="csv file of listings to load, or a "
+                             "directory or glob of partition files")
+    parser.add_argument("--workers", type=int, default=1,
+                        help="processes used to parse the file")
+    parser.add_argument("--snapshot", action="store_true",
+                        help="load from and save a binary snapshot")
+    parser.add_argument("--aggregate-cache", action="store_true",
+                        help="restore saved aggregates instead of reading "
+                             "an unchanged file")
+    parser.add_argument("--sqlite", action="store_true",
+                        help="keep the rows in a SQLite database next to "
+                             "the file and query it with SQL")
+    parser.add_argument("--append", action="append", default=[],
+                        help="file of new listings to add after loading; "
+                             "may be repeated")
+    parser.add_argument("--columns", action="append", default=[],
+                        help="extra csv column to keep for group "
+                             "queries; may be repeated")
+    parser.add_argument("--query", action="append", default=[],
+                        help="cross[:STAT], field[:CATEGORY[:STATS]], "
+                             "group:COLUMNS, or a JSON object; may be "
+                             "repeated")
+    parser.add_argument("--query-file",
+                        help="file with one query per line")
+    parser.add_argument("--stdin", action="store_true",
+                        help="keep answering queries read from standard "
+                             "input, one per line")
+    parser.add_argument("--format", choices=formatters, default="text")
+    parser.add_argument("--currency", choices=conversions)
+    parser.add_argument("--approximate", action="store_true",
+                        help="estimate percentiles from sketches")
+    parser.add_argument("--sampled", action="store_true",
+                        help="estimate cross table percentiles from "
+                             "samples, with confidence intervals")
+    parser.add_argument("--confidence", type=float, default=0.95,
+                        help="confidence level of sampled intervals")
+    parser.add_argument("--max-error", type=float,
+                        help="compute sampled cells exactly when their "
+                             "relative error is larger than this")
+    parser.add_argument("--time-budget", type=float, metavar="SECONDS",
+                        help="stop computing sampled cells exactly after "
+                             "this long")
+    parser.add_argument("--location", action="append",
+                        help="only include this location; may be repeated")
+    parser.add_argument("--property-type", action="append",
+                        help="only include this property type; may be "
+                             "repeated")
+    parser.add_argument("--serve", action="store_true",
+                        help="answer JSON requests from local clients")
+    parser.add_argument("--load-test", type=int, metavar="REQUESTS",
+                        help="send requests to a running server")
+    parser.add_argument("--clients", type=int, default=10,
+                        help="concurrent clients used by --load-test")
+    parser.add_argument("--threads", type=int, default=4,
+                        help="threads answering requests for --serve")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8765)
+    parser.add_argument("--profile", action="store_true",
+                        help="print a profile of the run to stderr, "
+                             "without peak bytes for --serve, where "
+                             "threads share the traced memory")
+    parser.add_argument("--benchmark", nargs="*", type=int,
+                        metavar="ROWS",
+                        help="run the benchmark suite at these sizes")
+    return parser.parse_args(arguments)
 
 
 def menu(dataset):
@@ -388,7 +3712,7 @@ def menu(dataset):
                 manage_filters(dataset, Categories.PROPERTY_TYPE)
             elif users_choice == 8:
                 print("Loading Data...")
-                dataset.load_file()
+                dataset.load_file(snapshot=True)
                 print("Data successfully loaded")
             elif users_choice == 9:
                 print("Goodbye!!! Thank you for using Foothill's "
@@ -425,7 +3749,31 @@ def main():
 
 
 if __name__ == "__main__":
-    main()
+    command_line = parse_arguments()
+    if command_line.profile:
+        enable_profiling(trace_memory=not command_line.serve)
+    if command_line.benchmark is not None:
+        benchmark(tuple(command_line.benchmark) or
+                  (50000, 1000000, 10000000))
+    elif command_line.batch:
+        batch(command_line)
+    elif command_line.serve:
+        served = VersionedDataSet(functools.partial(
+            load_arguments, arguments=command_line, progress=sys.stderr))
+        served.reload()
+        try:
+            asyncio.run(serve(served, command_line.host,
+                              command_line.port, command_line.threads))
+        except KeyboardInterrupt:
+            pass
+    elif command_line.load_test:
+        print(json.dumps(asyncio.run(load_test(
+            command_line.host, command_line.port, command_line.load_test,
+            command_line.clients)), indent=2))
+    else:
+        main()
+    if profiler is not None:
+        print(profiler.report(), file=sys.stderr)
 
 """
 --- Sample Output ---